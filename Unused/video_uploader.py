@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import os
+import time
 from picamera2 import Picamera2
 from picamera2.encoders import H264Encoder
 from picamera2.outputs import FfmpegOutput
@@ -39,9 +40,9 @@ try:
     print("Playlist URL: http://192.168.28.25:8000/stream.m3u8 (Python http.server)")
     print("or            http://192.168.28.25/stream.m3u8 (nginx, if configured)")
 
-    # Keep process alive
+    # Keep process alive (sleeping, a bare `pass` loop burns a whole core)
     while True:
-        pass
+        time.sleep(1)
     
 except KeyboardInterrupt:
     # CTRL+C stops the script gracefully
@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+import asyncio
+import base64
+import json
+import struct
+import threading
+import time
+from contextlib import aclosing
+from urllib.parse import parse_qs
+from camera_stream import mjpeg_part, snapshot_etag, etag_sequence, wait_timeout
+from flask_app import (rooms, main_room, grid, hls, scheduler, health_status, page_asset,
+                       alert_asset)
+import metrics
+
+# === Project notes ============================================================
+# Same routes as flask_app.py but served by an asyncio server (uvicorn), so an
+# endless /video or /audio connection is a coroutine instead of an OS thread.
+# The rooms (camera/audio/motion of each) are the ones flask_app.py already created.
+#
+#   pip install uvicorn
+#   python3 asgi_app.py
+# ==============================================================================
+
+# /ws carries video, audio and motion over one WebSocket (uvicorn needs the
+# websockets package: pip install websockets). The first message is JSON text
+# describing the streams; every message after that is binary: WS_HEADER
+# (kind, flags, reserved, sequence, capture time as unix seconds) followed by
+# a JPEG, one or more audio blocks (no WAV header), or a motion event as JSON.
+# Capture times come from one clock, so clients can line audio and video up.
+WS_HEADER = struct.Struct("<BBHId")
+WS_VIDEO, WS_AUDIO, WS_MOTION = 1, 2, 3
+
+
+class AsyncFeed:
+    """Relays a threading.Condition counter into asyncio with one helper thread.
+
+    Clients await the next counter value and then read the source themselves
+    without blocking, so the thread count stays at one per source.
+    """
+
+    def __init__(self, condition, get_counter):
+        self.condition = condition
+        self.get_counter = get_counter
+        self.counter = get_counter()
+        self.loop = None
+        self.changed = None
+
+    def start(self, loop):
+        self.loop = loop
+        self.changed = asyncio.Event()
+        threading.Thread(target=self._pump, daemon=True).start()
+
+    def _pump(self):
+        counter = self.counter
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.get_counter() != counter, 5)
+                new_counter = self.get_counter()
+            if new_counter != counter:
+                counter = new_counter
+                try:
+                    self.loop.call_soon_threadsafe(self._publish, counter)
+                except RuntimeError:
+                    return  # event loop closed, server is shutting down
+
+    def _publish(self, counter):
+        self.counter = counter
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self, counter, timeout=None):
+        """Wait until the counter moves past the given value, return the new value.
+
+        Counters only grow, and a client may already have read further than this
+        feed has relayed (latest() races ahead of the pump), so wait while <=.
+        The timeout covers the whole wait, not each change in between.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while self.counter <= counter:
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return self.counter
+
+
+feeds = {}
+
+
+def feed_for(source, get_counter, condition=None):
+    # One feed per broadcaster/ring/motion detector, created on first use since
+    # compressed audio rings (and tiers nobody watches) may never be needed
+    feed = feeds.get(id(source))
+    if feed is None:
+        feed = feeds[id(source)] = AsyncFeed(condition or source.condition, get_counter)
+        feed.start(asyncio.get_running_loop())
+    return feed
+
+
+def video_feed(broadcaster):
+    return feed_for(broadcaster, lambda: broadcaster.sequence)
+
+
+def audio_feed(ring):
+    return feed_for(ring, lambda: ring.write_index)
+
+
+def motion_feed(motion):
+    return feed_for(motion, lambda: motion.event_count)
+
+
+def hls_feed(segmenter):
+    return feed_for(segmenter, lambda: segmenter.next_number, segmenter.lock)
+
+
+async def video_frames(source, client):
+    """(sequence, jpeg, capture time) for a registered client, always the newest frame.
+
+    send() waits for the transport to drain, so a slow client simply skips to
+    whatever frame is newest when it is ready again.
+    """
+    broadcaster = source.tiers[client.tier]
+    feed = video_feed(broadcaster)
+    sequence = 0
+    while True:
+        if source.follow_auto_tier(client):
+            broadcaster = source.tiers[client.tier]
+            feed = video_feed(broadcaster)
+            sequence = 0
+        await feed.wait(sequence)
+        sequence, jpeg, timestamp = broadcaster.latest()
+        yield sequence, jpeg, timestamp
+
+
+async def generate_mjpeg(source, name, tier):
+    client = source.register_client(name, tier)
+    try:
+        async with aclosing(video_frames(source, client)) as frames:
+            async for sequence, jpeg, _ in frames:
+                part = mjpeg_part(jpeg)
+                client.record(sequence, len(part))
+                yield part
+    finally:
+        source.unregister_client(client)
+
+
+async def audio_blocks(ring):
+    """(first block number, blocks, capture time of the first) as they are written"""
+    feed = audio_feed(ring)
+    ring.subscribe()
+    try:
+        cursor = ring.latest_cursor()
+        while True:
+            await feed.wait(cursor)
+            cursor, data = ring.read(cursor, timeout=0)
+            if data:
+                first = cursor - len(data) // ring.block_size
+                yield first, data, ring.block_time(first)
+    finally:
+        ring.unsubscribe()
+
+
+async def generate_audio(audio, codec):
+    ring, header = audio.source(codec)
+    yield header
+    audio.add_listener()
+    try:
+        async with aclosing(audio_blocks(ring)) as blocks:
+            async for _, data, _ in blocks:
+                yield data
+    finally:
+        audio.remove_listener()
+
+
+async def generate_events(motion):
+    count = motion.event_count
+    current = {
+        'count': count,
+        'motion': motion.motion_detected,
+        'last_time': motion.last_motion_time,
+    }
+    yield f"retry: 2000\ndata: {json.dumps(current)}\n\n".encode()
+
+    while True:
+        if await motion_feed(motion).wait(count, timeout=15) <= count:
+            yield b": keep-alive\n\n"
+            continue
+        events = motion.events_since(count, timeout=0)
+        for event in events:
+            yield f"id: {event['count']}\ndata: {json.dumps(event)}\n\n".encode()
+        if events:
+            count = events[-1]['count']
+
+
+async def websocket_session(room, scope, receive, send, query):
+    camera, audio, motion = room.camera, room.audio, room.motion
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+
+    streams = query.get('streams', ['video,audio,motion'])[0].split(',')
+    codec = query.get('codec', ['pcm'])[0]
+    ring, wav_header = audio.source(codec)
+    # Only a session that takes video counts as a viewer (and keeps the camera on)
+    client = None
+    if 'video' in streams:
+        client = camera.register_client(client_name(scope) + ' (ws)', query.get('tier', ['high'])[0])
+    send_lock = asyncio.Lock()
+
+    async def send_message(kind, sequence, timestamp, payload):
+        message = WS_HEADER.pack(kind, 0, 0, sequence & 0xFFFFFFFF, timestamp) + payload
+        async with send_lock:
+            await send({'type': 'websocket.send', 'bytes': message})
+        return len(message)
+
+    async def send_video():
+        async with aclosing(video_frames(camera, client)) as frames:
+            async for sequence, jpeg, timestamp in frames:
+                client.record(sequence, await send_message(WS_VIDEO, sequence, timestamp, jpeg))
+
+    async def send_audio():
+        audio.add_listener()
+        try:
+            async with aclosing(audio_blocks(ring)) as blocks:
+                async for first, data, timestamp in blocks:
+                    await send_message(WS_AUDIO, first, timestamp, data)
+        finally:
+            audio.remove_listener()
+
+    async def send_motion():
+        count = motion.event_count
+        while True:
+            await motion_feed(motion).wait(count)
+            for event in motion.events_since(count, timeout=0):
+                await send_message(WS_MOTION, event['count'], event['timestamp'],
+                                   json.dumps(event).encode())
+                count = event['count']
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'websocket.disconnect':
+            pass
+
+    hello = {
+        'type': 'hello',
+        'header': {'format': WS_HEADER.format, 'size': WS_HEADER.size,
+                   'kinds': {'video': WS_VIDEO, 'audio': WS_AUDIO, 'motion': WS_MOTION}},
+        'streams': streams,
+        'video': {'tier': client.tier, 'auto': client.auto} if client else None,
+        'audio': {'codec': codec if ring is not audio.ring else 'pcm', 'rate': audio.RATE,
+                  'channels': audio.CHANNELS, 'block_size': ring.block_size,
+                  'wav_header': base64.b64encode(wav_header).decode()},
+        'motion': {'motion': motion.motion_detected, 'last_time': motion.last_motion_time,
+                   'count': motion.event_count},
+    }
+    senders = {'video': send_video, 'audio': send_audio, 'motion': send_motion}
+    tasks = [asyncio.ensure_future(wait_for_disconnect())]
+    try:
+        await send({'type': 'websocket.send', 'text': json.dumps(hello)})
+        tasks += [asyncio.ensure_future(senders[name]()) for name in streams if name in senders]
+        # Ends when the client leaves or a send fails because it is gone
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if client:
+            camera.unregister_client(client)
+
+
+def client_name(scope):
+    client = scope.get('client')
+    return client[0] if client else 'viewer'
+
+
+def request_header(scope, name):
+    for key, value in scope.get('headers', ()):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+async def snapshot(camera, tier, newer_than, timeout):
+    """FrameSource.snapshot() without a thread: a long poll waits on the tier's feed"""
+    broadcaster = camera.tier(tier)
+    sequence, jpeg, timestamp = broadcaster.latest()
+    stale = time.time() - timestamp > max(1.0, 2 * camera.frame_interval)
+    target = max(newer_than, sequence if stale else 0)
+    if sequence > target:
+        return sequence, jpeg
+
+    broadcaster.subscribe()
+    try:
+        await video_feed(broadcaster).wait(target, timeout)
+        sequence, jpeg, _ = broadcaster.latest()
+    finally:
+        broadcaster.unsubscribe()
+    if sequence <= target:
+        return 0, None
+    return sequence, jpeg
+
+
+async def send_snapshot(camera, send, scope, query):
+    # Same rules as flask_app's /snapshot.jpg
+    tier = query.get('tier', ['high'])[0]
+    if tier not in camera.tiers:
+        tier = 'high'
+    newer_than = etag_sequence(query.get('wait_newer', ['0'])[0], tier)
+    try:
+        timeout = wait_timeout(query.get('timeout', [None])[0]) if newer_than else 5
+    except ValueError:
+        await send_response(send, 400, 'application/json',
+                            json.dumps({'error': 'timeout must be a number of seconds'}).encode())
+        return
+    sequence, jpeg = await snapshot(camera, tier, newer_than, timeout)
+    if jpeg is None and not newer_than:
+        await send_response(send, 503, 'text/plain', b'Camera is starting',
+                            [(b'retry-after', b'1')])
+        return
+
+    etag = f'"{snapshot_etag(tier, sequence or newer_than)}"'
+    headers = [(b'etag', etag.encode()), (b'cache-control', b'no-cache'),
+               (b'x-frame-sequence', str(sequence).encode())]
+    if_none_match = request_header(scope, b'if-none-match') or ''
+    if jpeg is None or etag in [tag.strip() for tag in if_none_match.split(',')]:
+        await send_response(send, 304, 'image/jpeg', b'', headers)
+    else:
+        await send_response(send, 200, 'image/jpeg', jpeg, headers)
+
+
+async def send_response(send, status, content_type, body, headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode()),
+                    (b'content-length', str(len(body)).encode()), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_asset(send, scope, asset):
+    if asset is None:
+        await send_response(send, 404, 'text/plain', b'Not Found')
+        return
+    status, headers, body = asset.respond(
+        request_header(scope, b'accept-encoding'), request_header(scope, b'if-none-match'),
+        request_header(scope, b'range'), request_header(scope, b'if-range'))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+    })
+    await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else body})
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            return body
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def video_quality(controller, scope, receive, send):
+    # Same as flask_app's /video/quality; pin()/reset() may wait on the camera lock
+    try:
+        if scope['method'] == 'POST':
+            body = await read_body(receive)
+            limits = json.loads(body) if body else None
+            await asyncio.to_thread(controller.pin, **(limits or {}))
+        elif scope['method'] == 'DELETE':
+            await asyncio.to_thread(controller.reset)
+    except (TypeError, ValueError) as e:
+        await send_response(send, 400, 'application/json', json.dumps({'error': str(e)}).encode())
+        return
+    await send_response(send, 200, 'application/json', json.dumps(controller.status()).encode())
+
+
+async def send_hls(camera, send, path):
+    # Same as flask_app's /hls/ routes, a playlist waits (on the event loop) for the first segment
+    if path == '/hls/stream.m3u8':
+        if hls is None:
+            await send_response(send, 404, 'text/plain', b'HLS is disabled')
+            return
+        # HLS players only poll, so every playlist fetch keeps the camera awake
+        camera.keep_alive(30)
+        playlist = hls.playlist()
+        if playlist is None:
+            await hls_feed(hls).wait(hls.next_number, timeout=10)
+            playlist = hls.playlist()
+        if playlist is None:
+            await send_response(send, 503, 'text/plain', b'Stream starting, try again')
+            return
+        await send_response(send, 200, 'application/vnd.apple.mpegurl', playlist.encode(),
+                            [(b'cache-control', b'no-cache')])
+        return
+    name = path[len('/hls/'):]
+    number = name[len('segment'):-len('.ts')]
+    data = None
+    if hls is not None and name == f'segment{number}.ts' and number.isdigit():
+        data = hls.segment(int(number))
+    if data is None:
+        await send_response(send, 404, 'text/plain', b'Segment expired')
+        return
+    await send_response(send, 200, 'video/mp2t', data, [(b'cache-control', b'max-age=60')])
+
+
+async def send_stream(send, receive, content_type, chunks):
+    """Send an endless body until the client goes away"""
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', content_type.encode()),
+                    (b'cache-control', b'no-cache')],
+    })
+
+    async def pump():
+        async for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(wait_for_disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await chunks.aclose()
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # /rooms/<id>/video etc. are the same routes for another room
+    room, path = main_room, scope['path']
+    if path.startswith('/rooms/'):
+        room_id, slash, rest = path[len('/rooms/'):].partition('/')
+        room = rooms.get(room_id)
+        if room is None or not slash:
+            # /rooms/<id> without the slash would break the page's relative URLs
+            if room is not None and scope['type'] == 'http':
+                await send_response(send, 308, 'text/plain', b'',
+                                    [(b'location', (path + '/').encode())])
+            elif scope['type'] == 'http':
+                await send_response(send, 404, 'text/plain', b'Not Found')
+            else:
+                await send({'type': 'websocket.close', 'code': 1008})
+            return
+        path = '/' + rest
+    camera, audio, motion = room.camera, room.audio, room.motion
+
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if scope['type'] == 'websocket':
+        if path == '/ws':
+            await websocket_session(room, scope, receive, send, query)
+        else:
+            await send({'type': 'websocket.close', 'code': 1008})
+        return
+    if scope['type'] != 'http':
+        return
+
+    if path == '/':
+        await send_asset(send, scope, page_asset)
+    elif path == '/rooms':
+        body = json.dumps({'rooms': [r.summary() for r in rooms.values()],
+                           'cpu': scheduler.status()}).encode()
+        await send_response(send, 200, 'application/json', body)
+    elif path == '/video':
+        await send_stream(send, receive, 'multipart/x-mixed-replace; boundary=FRAME',
+                          generate_mjpeg(camera, client_name(scope), query.get('tier', ['high'])[0]))
+    elif path == '/grid/video' and grid is not None:
+        await send_stream(send, receive, 'multipart/x-mixed-replace; boundary=FRAME',
+                          generate_mjpeg(grid, client_name(scope), 'high'))
+    elif path == '/video/clients':
+        body = json.dumps({'clients': camera.client_stats()}).encode()
+        await send_response(send, 200, 'application/json', body)
+    elif path == '/video/quality':
+        await video_quality(room.controller, scope, receive, send)
+    elif path == '/snapshot.jpg':
+        await send_snapshot(camera, send, scope, query)
+    elif path == '/audio':
+        await send_stream(send, receive, 'audio/x-wav',
+                          generate_audio(audio, query.get('codec', ['pcm'])[0]))
+    elif path == '/motion':
+        body = json.dumps({
+            'motion': motion.motion_detected,
+            'last_time': motion.last_motion_time,
+            'count': motion.event_count,
+            'callbacks': motion.dispatcher.stats(),
+            'video_motion': room.video_motion.motion_detected,
+            'video_score': round(room.video_motion.score, 4)
+        }).encode()
+        await send_response(send, 200, 'application/json', body)
+    elif path == '/motion/events':
+        await send_stream(send, receive, 'text/event-stream', generate_events(motion))
+    elif path == '/sound':
+        sound = room.sound
+        try:
+            seconds = int(query.get('seconds', ['60'])[0])
+            if seconds < 0:
+                raise ValueError
+        except ValueError:
+            await send_response(send, 400, 'application/json', json.dumps(
+                {'error': 'seconds must be a whole number of seconds'}).encode())
+            return
+        body = json.dumps({
+            'sound': sound.sound_detected,
+            'last_time': sound.last_sound_time,
+            'levels': sound.levels,
+            'history': sound.level_history(seconds=seconds)
+        }).encode()
+        await send_response(send, 200, 'application/json', body)
+    elif path.startswith('/hls/') and room is main_room:
+        await send_hls(camera, send, path)
+    elif path == '/health':
+        ready, report = health_status()
+        await send_response(send, 200 if ready else 503, 'application/json',
+                            json.dumps(report).encode())
+    elif path == '/events':
+        try:
+            body = await asyncio.to_thread(
+                room.event_store.query, query.get('since', [None])[0],
+                query.get('until', [None])[0], query.get('bucket', [None])[0])
+        except ValueError as e:
+            await send_response(send, 400, 'application/json', json.dumps({'error': str(e)}).encode())
+            return
+        await send_response(send, 200, 'application/json', json.dumps(body).encode())
+    elif path == '/metrics':
+        await send_response(send, 200, 'text/plain; version=0.0.4',
+                            metrics.REGISTRY.render().encode())
+    elif path == '/alert.mp3':
+        await send_asset(send, scope, alert_asset)
+    else:
+        await send_response(send, 404, 'text/plain', b'Not Found')
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    print("👶 Baby Monitor Starting (asyncio server)...")
+    try:
+        uvicorn.run(app, host="0.0.0.0", port=8080, lifespan="on", log_level="warning")
+    finally:
+        print("\n🛑 Stopping...")
+        if grid is not None:
+            grid.stop()
+        for room in rooms.values():
+            room.stop()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+import numpy as np
+
+
+# === Project notes ============================================================
+# Compressed formats for /audio, all still wrapped in a WAV header so browsers
+# can play them from an <audio> tag:
+#   pcm    16-bit PCM        256 kbit/s at 16 kHz mono (format tag 1)
+#   mulaw  G.711 mu-law      128 kbit/s (format tag 7), NumPy vectorised
+#   adpcm  IMA/DVI ADPCM     ~65 kbit/s (format tag 0x11), 4 bits per sample
+# Browser support for the non-PCM tags varies, pcm stays the default.
+# ==============================================================================
+
+
+def wav_header(format_tag, channels, rate, bits, block_align, byte_rate, extra=None):
+    """Streaming WAV header (sizes set to the maximum, the stream never ends)"""
+    fmt = bytearray()
+    fmt += (format_tag).to_bytes(2, 'little')
+    fmt += (channels).to_bytes(2, 'little')
+    fmt += (rate).to_bytes(4, 'little')
+    fmt += (byte_rate).to_bytes(4, 'little')
+    fmt += (block_align).to_bytes(2, 'little')
+    fmt += (bits).to_bytes(2, 'little')
+    if extra is not None:
+        fmt += len(extra).to_bytes(2, 'little') + extra
+
+    header = bytearray()
+    header += b'RIFF' + (0xFFFFFFFF).to_bytes(4, 'little') + b'WAVE'
+    header += b'fmt ' + len(fmt).to_bytes(4, 'little') + fmt
+    header += b'data' + (0xFFFFFFFF).to_bytes(4, 'little')
+    return bytes(header)
+
+
+class PcmCodec:
+    name = "pcm"
+
+    def __init__(self, rate, channels, chunk):
+        self.rate = rate
+        self.channels = channels
+        self.block_size = chunk * channels * 2
+        self.samples_per_block = chunk
+
+    def header(self):
+        return wav_header(1, self.channels, self.rate, 16, self.channels * 2,
+                          self.rate * self.channels * 2)
+
+    def reset(self):
+        pass
+
+    def pending_samples(self):
+        """Samples received but not yet in an encoded block"""
+        return 0
+
+    def encode(self, data):
+        return [data]
+
+
+# Upper bound of each mu-law segment for the 14-bit magnitude (same as g711.c)
+MULAW_SEGMENT_ENDS = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+MULAW_BIAS = 0x21
+MULAW_CLIP = 8159
+
+
+def mulaw_encode(pcm):
+    """G.711 mu-law encode an int16 array, returns uint8 array"""
+    samples = pcm.astype(np.int32) >> 2
+    mask = np.where(samples < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(samples), MULAW_CLIP) + MULAW_BIAS
+    segment = np.searchsorted(MULAW_SEGMENT_ENDS, magnitude)
+    code = (segment << 4) | ((magnitude >> (segment + 1)) & 0x0F)
+    code = np.where(segment >= 8, 0x7F, code)
+    return (code ^ mask).astype(np.uint8)
+
+
+class MulawCodec(PcmCodec):
+    name = "mulaw"
+
+    def __init__(self, rate, channels, chunk):
+        super().__init__(rate, channels, chunk)
+        self.block_size = chunk * channels
+
+    def header(self):
+        return wav_header(7, self.channels, self.rate, 8, self.channels,
+                          self.rate * self.channels, extra=b"")
+
+    def encode(self, data):
+        return [mulaw_encode(np.frombuffer(data, dtype=np.int16)).tobytes()]
+
+
+IMA_STEPS = [
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767,
+]
+IMA_INDEX_ADJUST = [-1, -1, -1, -1, 2, 4, 6, 8]
+
+
+class AdpcmCodec(PcmCodec):
+    """IMA ADPCM in standard WAV blocks (mono only).
+
+    Each sample's code depends on the previous prediction, so this part can't
+    be vectorised; it runs once per block for all listeners of this codec.
+    """
+    name = "adpcm"
+
+    def __init__(self, rate, channels, chunk, block_align=256):
+        super().__init__(rate, channels, chunk)
+        self.block_size = block_align
+        self.samples_per_block = (block_align - 4) * 2 + 1
+        self.reset()
+
+    def header(self):
+        byte_rate = self.rate * self.block_size // self.samples_per_block
+        return wav_header(0x11, 1, self.rate, 4, self.block_size, byte_rate,
+                          extra=self.samples_per_block.to_bytes(2, 'little'))
+
+    def reset(self):
+        self.pending = np.zeros(0, dtype=np.int16)
+        self.index = 0
+
+    def pending_samples(self):
+        return len(self.pending)
+
+    def encode(self, data):
+        self.pending = np.concatenate((self.pending, np.frombuffer(data, dtype=np.int16)))
+        blocks = []
+        while len(self.pending) >= self.samples_per_block:
+            blocks.append(self._encode_block(self.pending[:self.samples_per_block].tolist()))
+            self.pending = self.pending[self.samples_per_block:]
+        return blocks
+
+    def _encode_block(self, samples):
+        # Block header: first sample verbatim, then the step index
+        predictor = samples[0]
+        index = self.index
+        block = bytearray(self.block_size)
+        block[0:2] = predictor.to_bytes(2, 'little', signed=True)
+        block[2] = index
+
+        steps, adjust = IMA_STEPS, IMA_INDEX_ADJUST
+        position = 4
+        low = None
+        for sample in samples[1:]:
+            step = steps[index]
+            diff = sample - predictor
+            code = 0
+            if diff < 0:
+                code = 8
+                diff = -diff
+            delta = step >> 3
+            if diff >= step:
+                code |= 4
+                diff -= step
+                delta += step
+            if diff >= step >> 1:
+                code |= 2
+                diff -= step >> 1
+                delta += step >> 1
+            if diff >= step >> 2:
+                code |= 1
+                delta += step >> 2
+
+            predictor = predictor - delta if code & 8 else predictor + delta
+            predictor = max(-32768, min(32767, predictor))
+            index = max(0, min(88, index + adjust[code & 7]))
+
+            # Two samples per byte, first one in the low nibble
+            if low is None:
+                low = code
+            else:
+                block[position] = low | (code << 4)
+                position += 1
+                low = None
+
+        self.index = index
+        return bytes(block)
+
+
+CODECS = {codec.name: codec for codec in (PcmCodec, MulawCodec, AdpcmCodec)}
@@ -1,54 +1,263 @@
 #!/usr/bin/env python3
-import pyaudio
+import os
+import time
+import threading
+if os.environ.get("BABY_MONITOR_FAKE_HARDWARE"):
+    from fake_hardware import pyaudio
+else:
+    import pyaudio
+from audio_codecs import CODECS
+import metrics
+
+DEVICE_OVERRUNS = metrics.counter(
+    "audio_device_overruns_total", "Microphone buffer overflows (samples lost before we read them)")
+LISTENER_SKIPS = metrics.counter(
+    "audio_listener_skips_total", "Times a listener fell a whole ring behind and skipped ahead")
+
+
+class AudioRing:
+    """Preallocated ring of fixed-size PCM blocks, one writer and any number of readers"""
+
+    def __init__(self, block_size, blocks=64):
+        self.block_size = block_size
+        self.blocks = blocks
+        self.buffer = bytearray(block_size * blocks)
+        self.view = memoryview(self.buffer)
+        self.write_index = 0  # total blocks ever written, never wraps
+        self.times = [0.0] * blocks  # capture time of each block's first sample
+        self.condition = threading.Condition()
+        self.subscribers = 0
+
+    def subscribe(self):
+        with self.condition:
+            self.subscribers += 1
+            self.condition.notify_all()
+
+    def unsubscribe(self):
+        with self.condition:
+            self.subscribers -= 1
+
+    def write(self, data, timestamp=None):
+        slot = self.write_index % self.blocks
+        start = slot * self.block_size
+        self.view[start:start + len(data)] = data
+        self.times[slot] = time.time() if timestamp is None else timestamp
+        with self.condition:
+            self.write_index += 1
+            self.condition.notify_all()
+
+    def block_time(self, index):
+        """Capture time of block number index (one of the last `blocks` written)"""
+        return self.times[index % self.blocks]
+
+    def latest_cursor(self):
+        return self.write_index
+
+    def read(self, cursor, timeout=None):
+        """Return (new_cursor, data) with every block written since cursor.
+
+        A reader that has fallen more than a ring behind skips ahead to the
+        newest block instead of replaying stale audio.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.write_index > cursor, timeout)
+            newest = self.write_index
+
+        if newest <= cursor:
+            return cursor, b""
+        if newest - cursor > self.blocks - 2:
+            LISTENER_SKIPS.inc()
+            cursor = newest - 1
+
+        start = (cursor % self.blocks) * self.block_size
+        end = (newest % self.blocks) * self.block_size
+        if start < end:
+            data = bytes(self.view[start:end])
+        else:
+            data = bytes(self.view[start:]) + bytes(self.view[:end])
+
+        # The writer may have lapped us while copying, drop the torn data
+        if self.write_index - cursor > self.blocks - 1:
+            LISTENER_SKIPS.inc()
+            return self.write_index - 1, b""
+        return newest, data
+
+
+class EncodedAudio:
+    """One codec's encoded blocks, encoded once and fanned out through their own ring"""
+
+    def __init__(self, audio, codec):
+        self.audio = audio
+        self.codec = codec
+        self.ring = AudioRing(codec.block_size)
+        self.thread = threading.Thread(target=self._encode_loop, daemon=True)
+        self.thread.start()
+
+    def _encode_loop(self):
+        pcm = self.audio.ring
+        while self.audio.running:
+            # Only encode while somebody is listening in this codec
+            with self.ring.condition:
+                if not self.ring.condition.wait_for(lambda: self.ring.subscribers > 0, timeout=1):
+                    continue
+
+            self.codec.reset()
+            pcm.subscribe()
+            try:
+                cursor = pcm.latest_cursor()
+                while self.audio.running and self.ring.subscribers:
+                    cursor, data = pcm.read(cursor, timeout=1)
+                    if data:
+                        # Each encoded block ends where the PCM read so far ends,
+                        # minus whatever the codec still holds back
+                        blocks = self.codec.encode(data)
+                        end = pcm.block_time(cursor - 1) + self.audio.CHUNK / self.audio.RATE
+                        end -= self.codec.pending_samples() / self.audio.RATE
+                        duration = self.codec.samples_per_block / self.audio.RATE
+                        for number, block in enumerate(blocks):
+                            self.ring.write(block, end - (len(blocks) - number) * duration)
+            finally:
+                pcm.unsubscribe()
 
 
 class AudioStream:
-    def __init__(self, device_index=3):
-        self.CHUNK = 128
+    def __init__(self, device_index=3, idle_timeout=None):
+        self.CHUNK = 512
         self.FORMAT = pyaudio.paInt16
         self.CHANNELS = 1
         self.RATE = 16000
         self.DEVICE_INDEX = device_index
-        self.p = pyaudio.PyAudio()
-
-    def generate_audio(self):
-        """Generate WAV audio stream"""
-        stream = self.p.open(
-            format=self.FORMAT,
-            channels=self.CHANNELS,
-            rate=self.RATE,
-            input=True,
-            frames_per_buffer=512,
-            input_device_index=self.DEVICE_INDEX
-        )
-
-        # WAV header
-        header = bytearray(44)
-        header[0:4] = b'RIFF'
-        header[4:8] = (0xFFFFFFFF).to_bytes(4, 'little')
-        header[8:12] = b'WAVE'
-        header[12:16] = b'fmt '
-        header[16:20] = (16).to_bytes(4, 'little')
-        header[20:22] = (1).to_bytes(2, 'little')
-        header[22:24] = (self.CHANNELS).to_bytes(2, 'little')
-        header[24:28] = (self.RATE).to_bytes(4, 'little')
-        header[28:32] = (self.RATE * self.CHANNELS * 2).to_bytes(4, 'little')
-        header[32:34] = (self.CHANNELS * 2).to_bytes(2, 'little')
-        header[34:36] = (16).to_bytes(2, 'little')
-        header[36:40] = b'data'
-        header[40:44] = (0xFFFFFFFF).to_bytes(4, 'little')
-
-        yield bytes(header)
+        self.OVERRUN_SLACK = 0.25  # seconds behind the clock that count as lost samples
+        self.p = None  # PyAudio probes every ALSA device, done on the capture thread
+        self.ready = threading.Event()
+        self.startup_error = None
+        self.ring = AudioRing(self.CHUNK * self.CHANNELS * 2)
+        self.pcm = CODECS["pcm"](self.RATE, self.CHANNELS, self.CHUNK)
 
+        # Compressed variants of the ring, created the first time someone asks
+        self.encoded = {}
+        self.encoded_lock = threading.Lock()
+
+        # With no listeners for idle_timeout seconds the mic is closed until the next one
+        self.idle_timeout = idle_timeout
+
+        # People listening over HTTP/WebSocket, unlike ring.subscribers this leaves
+        # out the detectors and the clip recorder (and counts every codec)
+        self.listeners = 0
+        self.listeners_lock = threading.Lock()
+
+        # One input stream shared by every listener
+        self.running = True
+        self.thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.thread.start()
+
+    def _wait_for_listener(self):
+        with self.ring.condition:
+            return self.ring.condition.wait_for(lambda: self.ring.subscribers > 0, timeout=1)
+
+    def _capture_loop(self):
         try:
-            while True:
-                data = stream.read(self.CHUNK, exception_on_overflow=False)
-                yield data
+            self.p = pyaudio.PyAudio()
         except Exception as e:
             print(f"Audio error: {e}")
+            self.startup_error = str(e)
+            return
+        self.ready.set()
+
+        while self.running:
+            if self.idle_timeout is not None and not self._wait_for_listener():
+                continue
+
+            stream = None
+            try:
+                stream = self.p.open(
+                    format=self.FORMAT,
+                    channels=self.CHANNELS,
+                    rate=self.RATE,
+                    input=True,
+                    frames_per_buffer=self.CHUNK,
+                    input_device_index=self.DEVICE_INDEX
+                )
+                idle_since = None
+                # Overflows are noticed as the clock running ahead of the samples read,
+                # so the block read after one is still delivered, not thrown away.
+                # Only a read that had to wait is caught up with the device; lag left
+                # then is samples the device dropped
+                clock_start = time.time()
+                samples = 0
+                while self.running:
+                    before = time.time()
+                    data = stream.read(self.CHUNK, exception_on_overflow=False)
+                    now = time.time()
+                    samples += self.CHUNK
+                    if now - before > 0.5 * self.CHUNK / self.RATE:
+                        lag = now - clock_start - samples / self.RATE
+                        if lag > self.OVERRUN_SLACK:
+                            DEVICE_OVERRUNS.inc()
+                        if lag > self.OVERRUN_SLACK or lag < 0:
+                            clock_start = now - samples / self.RATE
+                    # read() returns once the block is full, its first sample is older
+                    self.ring.write(data, now - self.CHUNK / self.RATE)
+
+                    if self.ring.subscribers:
+                        idle_since = None
+                    elif idle_since is None:
+                        idle_since = time.time()
+                    elif self.idle_timeout is not None and time.time() - idle_since > self.idle_timeout:
+                        print(f"   🎤 No listeners for {self.idle_timeout}s, closing microphone")
+                        break
+            except Exception as e:
+                print(f"Audio error: {e}")
+                time.sleep(1)
+            finally:
+                if stream is not None:
+                    stream.stop_stream()
+                    stream.close()
+
+    def wav_header(self):
+        return self.pcm.header()
+
+    def encoded_stream(self, codec):
+        with self.encoded_lock:
+            if codec not in self.encoded:
+                self.encoded[codec] = EncodedAudio(
+                    self, CODECS[codec](self.RATE, self.CHANNELS, self.CHUNK))
+            return self.encoded[codec]
+
+    def source(self, codec="pcm"):
+        """(ring, wav header) for a codec name, unknown names get plain PCM"""
+        if codec not in CODECS or codec == "pcm":
+            return self.ring, self.wav_header()
+        stream = self.encoded_stream(codec)
+        return stream.ring, stream.codec.header()
+
+    def add_listener(self):
+        with self.listeners_lock:
+            self.listeners += 1
+
+    def remove_listener(self):
+        with self.listeners_lock:
+            self.listeners -= 1
+
+    def generate_audio(self, codec="pcm"):
+        """Generate WAV audio stream from the shared ring"""
+        ring, header = self.source(codec)
+        yield header
+
+        ring.subscribe()
+        self.add_listener()
+        try:
+            cursor = ring.latest_cursor()
+            while True:
+                cursor, data = ring.read(cursor, timeout=5)
+                if data:
+                    yield data
         finally:
-            stream.stop_stream()
-            stream.close()
+            self.remove_listener()
+            ring.unsubscribe()
 
     def cleanup(self):
-        self.p.terminate()
\ No newline at end of file
+        self.running = False
+        self.thread.join(timeout=2)
+        if self.p is not None:
+            self.p.terminate()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""Load test the baby monitor with simulated viewers and listeners.
+
+Starts flask_app.py (or asgi_app.py) on the fake hardware backends, connects
+N MJPEG viewers and M audio listeners, and reports per-client frame rate,
+capture-to-client latency, audio throughput and the server's CPU and memory.
+Run it before and after a change to see what the change costs:
+
+    python3 benchmarks/bench_streams.py --viewers 4 --listeners 2 --duration 20
+    python3 benchmarks/bench_streams.py --server asgi --viewers 20 --tier low
+
+Latency needs the capture time the fake hardware MJPEG encoder writes into
+each JPEG, so it is only reported with encoder="mjpeg" (flask_app's default).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+import http.client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from fake_hardware import jpeg_timestamp  # noqa: E402
+
+HOST = "127.0.0.1"
+PORT = 8080
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class ProcessSampler:
+    """CPU seconds and resident memory of the server process, from /proc"""
+
+    def __init__(self, pid):
+        self.pid = pid
+
+    def cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime and stime are fields 14 and 15, i.e. 11 and 12 after the name
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+    def rss_mb(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return 0.0
+
+    def measure(self, seconds):
+        """(CPU % of one core, RSS MB) over the next `seconds`"""
+        cpu, start = self.cpu_seconds(), time.time()
+        time.sleep(seconds)
+        cpu_percent = 100 * (self.cpu_seconds() - cpu) / (time.time() - start)
+        return cpu_percent, self.rss_mb()
+
+
+class Viewer(threading.Thread):
+    def __init__(self, number, tier, stop):
+        super().__init__(daemon=True)
+        self.name = f"viewer{number}"
+        self.tier = tier
+        self.stop = stop
+        self.frames = 0
+        self.bytes = 0
+        self.latencies = []
+        self.error = None
+
+    def run(self):
+        conn = http.client.HTTPConnection(HOST, PORT, timeout=10)
+        try:
+            conn.request("GET", f"/video?tier={self.tier}")
+            stream = conn.getresponse()
+            while not self.stop.is_set():
+                if stream.readline().strip() != b"--FRAME":
+                    continue
+                length = 0
+                for line in iter(stream.readline, b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                jpeg = stream.read(length)
+                stream.read(2)
+                timestamp = jpeg_timestamp(jpeg)
+                if timestamp is not None:
+                    self.latencies.append(time.time() - timestamp)
+                self.frames += 1
+                self.bytes += len(jpeg)
+        except Exception as e:
+            self.error = e
+        finally:
+            conn.close()
+
+    def result(self, duration):
+        return {
+            "client": self.name,
+            "fps": round(self.frames / duration, 1),
+            "kbit_s": round(self.bytes * 8 / duration / 1000),
+            "latency_ms_p50": _ms(percentile(self.latencies, 0.5)),
+            "latency_ms_p95": _ms(percentile(self.latencies, 0.95)),
+            "error": repr(self.error) if self.error else None,
+        }
+
+
+class Listener(threading.Thread):
+    def __init__(self, number, codec, stop):
+        super().__init__(daemon=True)
+        self.name = f"listener{number}"
+        self.codec = codec
+        self.stop = stop
+        self.bytes = 0
+        self.longest_gap = 0.0
+        self.error = None
+
+    def run(self):
+        conn = http.client.HTTPConnection(HOST, PORT, timeout=10)
+        try:
+            conn.request("GET", f"/audio?codec={self.codec}")
+            response = conn.getresponse()
+            last = time.time()
+            while not self.stop.is_set():
+                data = response.read1(4096)
+                if not data:
+                    break
+                now = time.time()
+                self.longest_gap = max(self.longest_gap, now - last)
+                last = now
+                self.bytes += len(data)
+        except Exception as e:
+            self.error = e
+        finally:
+            conn.close()
+
+    def result(self, duration):
+        return {
+            "client": self.name,
+            "kbit_s": round(self.bytes * 8 / duration / 1000),
+            "longest_gap_ms": _ms(self.longest_gap),
+            "error": repr(self.error) if self.error else None,
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def get(path):
+    conn = http.client.HTTPConnection(HOST, PORT, timeout=5)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def wait_until_ready(server, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise SystemExit("Server exited during startup, see its output above")
+        try:
+            if get("/health")[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"Server not ready after {timeout} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask")
+    parser.add_argument("--viewers", type=int, default=4)
+    parser.add_argument("--listeners", type=int, default=2)
+    parser.add_argument("--tier", default="high", help="video tier for the viewers")
+    parser.add_argument("--codec", default="pcm", help="audio codec for the listeners")
+    parser.add_argument("--duration", type=float, default=20, help="seconds under load")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds idle before the load")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    script = "flask_app.py" if args.server == "flask" else "asgi_app.py"
+    env = dict(os.environ, BABY_MONITOR_FAKE_HARDWARE="1", PYTHONUNBUFFERED="1")
+    env.setdefault("BABY_MONITOR_FAKE_PIR_INTERVAL", "3600")
+    server = subprocess.Popen([sys.executable, script], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL if args.json else None)
+    try:
+        wait_until_ready(server)
+        sampler = ProcessSampler(server.pid)
+        idle_cpu, idle_rss = sampler.measure(args.warmup)
+
+        stop = threading.Event()
+        viewers = [Viewer(i, args.tier, stop) for i in range(args.viewers)]
+        listeners = [Listener(i, args.codec, stop) for i in range(args.listeners)]
+        for client in viewers + listeners:
+            client.start()
+        time.sleep(2)  # camera/mic warm start, not part of the measurement
+        for client in viewers:
+            client.frames, client.bytes, client.latencies = 0, 0, []
+        for client in listeners:
+            client.bytes, client.longest_gap = 0, 0.0
+
+        load_cpu, load_rss = sampler.measure(args.duration)
+        status, body = get("/video/clients")
+        server_clients = json.loads(body) if status == 200 else None
+        stop.set()
+
+        clients = max(args.viewers + args.listeners, 1)
+        report = {
+            "server": args.server,
+            "viewers": [v.result(args.duration) for v in viewers],
+            "listeners": [a.result(args.duration) for a in listeners],
+            "server_clients": server_clients,
+            "cpu_percent": {"idle": round(idle_cpu, 1), "loaded": round(load_cpu, 1),
+                            "per_client": round((load_cpu - idle_cpu) / clients, 2)},
+            "rss_mb": {"idle": round(idle_rss, 1), "loaded": round(load_rss, 1),
+                       "per_client": round((load_rss - idle_rss) / clients, 2)},
+        }
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print()
+    print(f"=== {args.server}: {args.viewers} viewers ({args.tier}), "
+          f"{args.listeners} listeners ({args.codec}), {args.duration:.0f} s ===")
+    for row in report["viewers"] + report["listeners"]:
+        print("  " + "  ".join(f"{key}={value}" for key, value in row.items()
+                               if value is not None))
+    print(f"  CPU %   idle {report['cpu_percent']['idle']}  loaded {report['cpu_percent']['loaded']}"
+          f"  per client {report['cpu_percent']['per_client']}")
+    print(f"  RSS MB  idle {report['rss_mb']['idle']}  loaded {report['rss_mb']['loaded']}"
+          f"  per client {report['rss_mb']['per_client']}")
+
+
+if __name__ == "__main__":
+    main()
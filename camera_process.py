@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+import struct
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from camera_stream import CameraStream, FrameSource
+
+
+# === Project notes ============================================================
+# Runs CameraStream (capture + JPEG encode) in its own process so it gets its
+# own core and its own GIL. Finished JPEGs are written into a small ring in
+# shared memory; the web process copies the newest one out once and hands it
+# to a normal FrameBroadcaster, so the Flask/ASGI routes don't change.
+#
+# Shared memory layout:
+#   header: latest sequence (u64)
+#   slot:   sequence (u64), length (u64), JPEG bytes (slot_size)
+# A slot's sequence is zeroed while it is being rewritten, readers that see a
+# different sequence before and after copying just try again.
+# ==============================================================================
+
+HEADER = struct.Struct("<Q")
+SLOT_HEADER = struct.Struct("<QQ")
+
+
+class SharedFrameRing:
+    def __init__(self, name=None, slots=4, slot_size=1024 * 1024):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.stride = SLOT_HEADER.size + slot_size
+        size = HEADER.size + self.stride * slots
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)  # zero-filled
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+
+    def latest_sequence(self):
+        return HEADER.unpack_from(self.buf, 0)[0]
+
+    def write(self, jpeg):
+        if len(jpeg) > self.slot_size:
+            print(f"Frame too large for shared slot ({len(jpeg)} bytes), skipped")
+            return
+        sequence = self.latest_sequence() + 1
+        offset = HEADER.size + (sequence % self.slots) * self.stride
+        SLOT_HEADER.pack_into(self.buf, offset, 0, 0)
+        start = offset + SLOT_HEADER.size
+        self.buf[start:start + len(jpeg)] = jpeg
+        SLOT_HEADER.pack_into(self.buf, offset, sequence, len(jpeg))
+        HEADER.pack_into(self.buf, 0, sequence)
+
+    def read_latest(self):
+        """Return (sequence, jpeg) for the newest complete frame, or (0, None)"""
+        for _ in range(3):
+            sequence = self.latest_sequence()
+            if sequence == 0:
+                return 0, None
+            offset = HEADER.size + (sequence % self.slots) * self.stride
+            before, length = SLOT_HEADER.unpack_from(self.buf, offset)
+            start = offset + SLOT_HEADER.size
+            jpeg = bytes(self.buf[start:start + length])
+            after, _ = SLOT_HEADER.unpack_from(self.buf, offset)
+            if before == after == sequence:
+                return sequence, jpeg
+        return 0, None
+
+    def close(self, unlink=False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def run_camera_worker(ring_name, condition, stop_event, ready, viewers, camera_kwargs):
+    """Entry point of the capture process"""
+    ring = SharedFrameRing(ring_name)
+    camera = CameraStream(**camera_kwargs)
+    subscribed = False
+    sequence = 0
+    try:
+        while not stop_event.is_set():
+            if not ready.is_set() and camera.ready.is_set():
+                ready.set()
+
+            # Mirror whether the web process has viewers so idle pausing still works
+            if bool(viewers.value) != subscribed:
+                subscribed = not subscribed
+                if subscribed:
+                    camera.broadcaster.subscribe()
+                else:
+                    camera.broadcaster.unsubscribe()
+
+            new_sequence, jpeg = camera.broadcaster.wait_for_frame(sequence, timeout=0.25)
+            if new_sequence == sequence:
+                continue
+            sequence = new_sequence
+            ring.write(jpeg)
+            with condition:
+                condition.notify_all()
+    finally:
+        camera.stop()
+        ring.close()
+
+
+class ProcessCameraStream(FrameSource):
+    """CameraStream whose capture and encoding happen in a separate process"""
+
+    separate_process = True
+
+    def __init__(self, resolution=(1280, 720), fps=15, name="camera", **camera_kwargs):
+        # The camera belongs to the worker; only the main stream is relayed
+        super().__init__(name, ("high",), fps)
+        self.resolution = resolution
+
+        # fork, not spawn: spawning would re-run flask_app.py in the child
+        context = multiprocessing.get_context("fork")
+        self.ring = SharedFrameRing()
+        self.condition = context.Condition()
+        self.stop_event = context.Event()
+        self.ready = context.Event()
+        self.startup_error = None
+        self.viewers = context.Value("i", 0, lock=False)
+        camera_kwargs.update(resolution=resolution, fps=fps, name=name)
+        self.process = context.Process(
+            target=run_camera_worker,
+            args=(self.ring.name, self.condition, self.stop_event, self.ready, self.viewers,
+                  camera_kwargs),
+            daemon=True
+        )
+        self.process.start()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Start relaying frames; separate from forking so every camera can fork first"""
+        self.running = True
+        self.thread = threading.Thread(target=self._relay_loop, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def _relay_loop(self):
+        last_sequence = 0
+        while self.running:
+            if not self.ready.is_set() and not self.process.is_alive():
+                self.startup_error = "capture process exited"
+            self.viewers.value = self.broadcaster.subscribers
+            with self.condition:
+                if self.ring.latest_sequence() == last_sequence:
+                    self.condition.wait(timeout=0.25)
+            sequence, jpeg = self.ring.read_latest()
+            if sequence != last_sequence and jpeg is not None:
+                last_sequence = sequence
+                self.broadcaster.publish(jpeg)
+
+    def stop(self):
+        self.running = False
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        self.process.join(timeout=5)
+        self.ring.close(unlink=True)
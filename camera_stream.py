@@ -1,41 +1,570 @@
 #!/usr/bin/env python3
 import io
+import os
 import time
+import socket
 import threading
-from picamera2 import Picamera2
+import itertools
+from collections import deque
+if os.environ.get("BABY_MONITOR_FAKE_HARDWARE"):
+    from fake_hardware import Picamera2, MappedArray, MJPEGEncoder, Output
+else:
+    from picamera2 import Picamera2, MappedArray
+    from picamera2.encoders import MJPEGEncoder
+    from picamera2.outputs import Output
 from PIL import Image
+import metrics
 
+try:
+    import simplejpeg  # installed alongside picamera2
+except ImportError:
+    simplejpeg = None
 
-class CameraStream:
-    def __init__(self, resolution=(1280, 720), fps=15):
-        self.picam2 = Picamera2()
+
+CAPTURE_SECONDS = metrics.histogram(
+    "camera_capture_seconds", "Time spent waiting for a frame from the camera", ["camera"])
+ENCODE_SECONDS = metrics.histogram(
+    "camera_encode_seconds", "Software JPEG encode time per frame", ["camera", "tier"])
+FRAME_BYTES = metrics.histogram(
+    "camera_frame_bytes", "Encoded JPEG frame size", ["camera", "tier"],
+    buckets=metrics.SIZE_BUCKETS)
+
+# Part of every snapshot ETag, so tags from before a restart never match
+BOOT_ID = format(int(time.time()), "x")
+
+
+def snapshot_etag(tier, sequence):
+    return f"{BOOT_ID}-{tier}-{sequence}"
+
+
+def etag_sequence(tag, tier):
+    """Frame sequence from a snapshot ETag or a bare number, 0 if it is from another run/tier"""
+    tag = tag.strip().strip('"')
+    if tag.isdigit():
+        return int(tag)
+    boot, _, rest = tag.partition("-")
+    tag_tier, _, sequence = rest.rpartition("-")
+    if boot != BOOT_ID or tag_tier != tier or not sequence.isdigit():
+        return 0
+    return int(sequence)
+
+
+def wait_timeout(value, default=10, limit=30):
+    """Seconds from a ?timeout= value, clamped to 0..limit; ValueError if it isn't a number"""
+    seconds = float(default if value is None else value)
+    if seconds != seconds:  # NaN
+        raise ValueError("timeout is not a number")
+    return min(max(seconds, 0.0), limit)
+
+
+class FrameBroadcaster:
+    """Shared slot holding the latest JPEG, numbered so readers can wait for the next one"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.sequence = 0
+        self.timestamp = 0.0
+        self.subscribers = 0
+
+    def subscribe(self):
+        with self.condition:
+            self.subscribers += 1
+
+    def unsubscribe(self):
+        with self.condition:
+            self.subscribers -= 1
+
+    def publish(self, jpeg, timestamp=None):
+        """timestamp: capture time of the frame, defaults to now"""
+        with self.condition:
+            self.frame = jpeg
+            self.sequence += 1
+            self.timestamp = time.time() if timestamp is None else timestamp
+            self.condition.notify_all()
+
+    def latest(self):
+        """(sequence, jpeg, capture time) of the newest frame, without waiting"""
+        with self.condition:
+            return self.sequence, self.frame, self.timestamp
+
+    def wait_for_frame(self, last_sequence, timeout=None):
+        """Block until a frame newer than last_sequence exists, return (sequence, jpeg)"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > last_sequence, timeout)
+            return self.sequence, self.frame
+
+
+def mjpeg_part(jpeg):
+    """Wrap one JPEG as a multipart/x-mixed-replace part"""
+    return (b"--FRAME\r\n"
+            b"Content-Type: image/jpeg\r\n"
+            b"Content-Length: " + str(len(jpeg)).encode() + b"\r\n\r\n" +
+            jpeg + b"\r\n")
+
+
+class BroadcastOutput(Output):
+    """picamera2 Output for the hardware MJPEG encoder, every frame is one whole JPEG.
+
+    Frames are published with their capture time rather than the time the
+    encoder finished them, so they line up with the audio blocks. picamera2
+    gives the sensor timestamp (monotonic clock, µs) counted from the
+    encoder's first frame, which the encoder keeps in firsttimestamp.
+    """
+
+    def __init__(self, broadcaster, encoder, camera_name="camera"):
+        super().__init__()
+        self.broadcaster = broadcaster
+        self.encoder = encoder
+        self.frame_bytes = FRAME_BYTES.labels(camera_name, "high")
+
+    def capture_time(self, timestamp):
+        """Wall clock capture time of a frame, None if it can't be worked out"""
+        first = getattr(self.encoder, "firsttimestamp", None)
+        if timestamp is None or first is None:
+            return None
+        now = time.time()
+        captured = now - (time.monotonic() - (first + timestamp) / 1_000_000)
+        # A sensor clock that isn't CLOCK_MONOTONIC would give nonsense, use arrival time then
+        return captured if 0 <= now - captured < 5 else None
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        self.frame_bytes.observe(len(frame))
+        self.broadcaster.publish(bytes(frame), self.capture_time(timestamp))
+
+
+class ClientStats:
+    """Frames sent vs. skipped for one connected viewer"""
+
+    ids = itertools.count(1)  # one per connection, the address alone isn't unique
+    FPS_WINDOW = 5.0  # seconds the reported frame rate is averaged over
+
+    def __init__(self, name, tier="high", auto=False):
+        self.id = next(self.ids)
+        self.name = name
+        self.tier = tier
+        self.auto = auto  # follows CameraStream.auto_tier
+        self.connected_at = time.time()
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.bytes_sent = 0
+        self.last_sequence = 0
+        self.send_times = deque(maxlen=512)
+
+    def record(self, sequence, size):
+        # Any sequence numbers we jumped over were frames this client was too slow for
+        if self.last_sequence:
+            self.frames_dropped += max(0, sequence - self.last_sequence - 1)
+        self.last_sequence = sequence
+        self.frames_sent += 1
+        self.bytes_sent += size
+        self.send_times.append(time.time())
+
+    def fps(self):
+        """Frames per second over the last FPS_WINDOW seconds (less for a new client)"""
+        now = time.time()
+        window = min(self.FPS_WINDOW, max(now - self.connected_at, 1.0))
+        return sum(1 for t in list(self.send_times) if t > now - window) / window
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'client': self.name,
+            'tier': self.tier,
+            'frames_sent': self.frames_sent,
+            'frames_dropped': self.frames_dropped,
+            'bytes_sent': self.bytes_sent,
+            'fps': round(self.fps(), 1),
+        }
+
+
+class FrameSource:
+    """Tiers of shared JPEGs and the viewers connected to them.
+
+    Whatever fills the broadcasters (a camera, the room grid) gets the same
+    viewer handling: tiers, the "auto" tier, per-client stats and snapshots.
+    """
+
+    # True when capture and encoding happen in another process, so there are
+    # no luma frames, extra encoders or frame rate/quality controls here
+    separate_process = False
+
+    def __init__(self, name="camera", tiers=("high",), fps=15):
+        self.name = name
+        self.tiers = {tier: FrameBroadcaster() for tier in tiers}
+        self.broadcaster = self.tiers["high"]
+        self.auto_tier = "high"  # what tier="auto" viewers get, see StreamController
+        self.frame_interval = 1.0 / fps
+        self.quality = 70
+        self.clients = set()
+
+        # How many frames a client's kernel send buffer may hold before we stop
+        # queueing more; keeps latency bounded for viewers on weak Wi-Fi
+        self.send_buffer_frames = 2
+
+    def snapshot(self, tier="high", newer_than=0, timeout=5):
+        """(sequence, jpeg) of the newest frame of a tier, 0/None if none came in time.
+
+        While anyone watches this is just the frame they already got. Otherwise
+        the last frame may be old, so the tier is subscribed until one fresh
+        frame is encoded (the camera then stays on for idle_timeout, which
+        suits pollers).
+        """
+        broadcaster = self.tier(tier)
+        with broadcaster.condition:
+            stale = time.time() - broadcaster.timestamp > max(1.0, 2 * self.frame_interval)
+            target = max(newer_than, broadcaster.sequence if stale else 0)
+            if broadcaster.sequence > target:
+                return broadcaster.sequence, broadcaster.frame
+
+        broadcaster.subscribe()
+        try:
+            sequence, jpeg = broadcaster.wait_for_frame(target, timeout)
+        finally:
+            broadcaster.unsubscribe()
+        if sequence <= target:
+            return 0, None
+        return sequence, jpeg
+
+    def tier(self, name):
+        """Broadcaster for a tier name, unknown or unavailable tiers fall back to high"""
+        return self.tiers.get(name, self.broadcaster)
+
+    def register_client(self, name, tier="high"):
+        auto = tier == "auto"
+        if auto:
+            tier = self.auto_tier
+        if tier not in self.tiers:
+            tier = "high"
+        client = ClientStats(name, tier, auto)
+        self.tiers[tier].subscribe()
+        self.clients.add(client)
+        return client
+
+    def follow_auto_tier(self, client):
+        """Move an "auto" client to the current auto_tier, True if it moved"""
+        tier = self.auto_tier
+        if not client.auto or tier == client.tier or tier not in self.tiers:
+            return False
+        self.tiers[tier].subscribe()
+        self.tiers[client.tier].unsubscribe()
+        client.tier = tier
+        client.last_sequence = 0  # sequence numbers are per tier
+        return True
+
+    def unregister_client(self, client):
+        if client in self.clients:
+            self.clients.discard(client)
+            self.tiers[client.tier].unsubscribe()
+
+    def client_stats(self):
+        return [client.as_dict() for client in list(self.clients)]
+
+    def limit_send_buffer(self, sock, frame_size):
+        """Shrink the socket send buffer so only a couple of frames can queue up"""
+        try:
+            size = max(frame_size * self.send_buffer_frames, 64 * 1024)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, size)
+        except (OSError, AttributeError):
+            pass
+
+    def generate_mjpeg(self, name="viewer", sock=None, tier="high"):
+        """Yield an endless MJPEG stream, always the newest frame when the client is ready.
+
+        The generator is only resumed once the previous part has been written,
+        so frames published while a slow client is still sending are skipped.
+        """
+        client = self.register_client(name, tier)
+        broadcaster = self.tiers[client.tier]
+        sequence = 0
+        try:
+            while True:
+                if self.follow_auto_tier(client):
+                    broadcaster = self.tiers[client.tier]
+                    sequence = 0
+                new_sequence, jpeg = broadcaster.wait_for_frame(sequence, timeout=5)
+                if new_sequence == sequence:
+                    continue
+                if sock is not None and sequence == 0:
+                    self.limit_send_buffer(sock, len(jpeg))
+                sequence = new_sequence
+
+                part = mjpeg_part(jpeg)
+                client.record(sequence, len(part))
+                yield part
+        finally:
+            self.unregister_client(client)
+
+
+
+class CameraStream(FrameSource):
+    def __init__(self, resolution=(1280, 720), fps=15, capture_format="RGB888",
+                 encoder="software", lores_resolution=(640, 360), idle_timeout=None,
+                 lock_exposure=False, camera_num=0, name="camera"):
+        if capture_format == "YUV420" and simplejpeg is None:
+            print("   simplejpeg not installed, falling back to RGB888 capture")
+            capture_format = "RGB888"
+        self.resolution = resolution
+        self.lores_resolution = lores_resolution
+        self.capture_format = capture_format
+        self.fps = fps
+        self.lock_exposure = lock_exposure
+        self.camera_num = camera_num  # which camera on a Pi 5 / multi-camera board
+
+        # The camera is opened by the capture thread so constructing this (and
+        # importing flask_app) doesn't block; ready is set once frames flow
+        self.picam2 = None
+        self.active = False
+        self.ready = threading.Event()
+        self.startup_error = None
+
+        # The lores stream (always YUV420) feeds the "low" tier for small screens
+        lores = None
+        if simplejpeg is not None:
+            lores = {"size": lores_resolution, "format": "YUV420"}
+        self.lores = lores
+
+        # Each tier is encoded once and shared by its viewers, and only while it has any
+        super().__init__(name, ("high", "low") if lores is not None else ("high",), fps)
+
+        # Small greyscale copies of each frame for software motion detection
+        self.luma = FrameBroadcaster()
+        self.luma_step = 4 if lores is not None else 8
+
+        # "mjpeg" hands encoding to the Pi's hardware JPEG encoder, which writes
+        # finished frames straight into the broadcaster; "software" encodes in Python
+        self.encoder = encoder
+        self.locked_controls = {}
+        self.rate_controls = {}  # set by set_frame_rate()
+        self.extra_encoders = []  # (encoder, output) pairs such as the HLS H.264 encoder
+        self.camera_lock = threading.Lock()
+        self.software_tiers = []
+
+        # With nobody watching for idle_timeout seconds the camera is stopped,
+        # the next viewer starts it again without the settle time
+        self.idle_timeout = idle_timeout
+        self.last_viewer_time = time.time()
+        self.keep_alive_until = 0
+
+        # One capture/encode thread no matter how many viewers are connected
+        self.running = True
+        self.thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.thread.start()
+
+    def _open_camera(self):
+        """Open, configure and start the camera (runs on the capture thread)"""
+        # YUV420 is half the bytes of RGB888 and is encoded straight out of the
+        # camera's own request buffers, which libcamera recycles (buffer_count)
+        self.picam2 = Picamera2(self.camera_num)
         config = self.picam2.create_video_configuration(
-            main={"size": resolution, "format": "RGB888"}
+            main={"size": self.resolution, "format": self.capture_format},
+            lores=self.lores,
+            buffer_count=4,
+            controls={"FrameRate": self.fps}
         )
         self.picam2.configure(config)
-        self.picam2.start()
-        time.sleep(2)
+
+        if self.encoder == "mjpeg":
+            self.hw_encoder = MJPEGEncoder()
+            self.hw_output = BroadcastOutput(self.broadcaster, self.hw_encoder, self.name)
+            try:
+                self._start_camera()
+            except Exception as e:
+                print(f"   Hardware MJPEG encoder unavailable ({e}), using software encoding")
+                self.encoder = "software"
+        if self.encoder != "mjpeg":
+            self.encoder = "software"
+            self._start_camera()
+
+        # Tiers the Python thread encodes; the hardware encoder covers "high" itself
+        self.software_tiers = [name for name in self.tiers
+                               if not (name == "high" and self.encoder == "mjpeg")]
+        self.ready.set()
+
+        # Stream straight away and lock exposure once AE/AWB have settled
+        if self.lock_exposure:
+            self._lock_exposure_later()
+
+    def _start_camera(self):
+        with self.camera_lock:
+            if self.encoder == "mjpeg":
+                self.picam2.start_recording(self.hw_encoder, self.hw_output)
+            else:
+                self.picam2.start()
+            for encoder, output in self.extra_encoders:
+                self.picam2.start_encoder(encoder, output, name="main")
+            if self.locked_controls or self.rate_controls:
+                self.picam2.set_controls({**self.locked_controls, **self.rate_controls})
+            self.active = True
+
+    def _stop_camera(self):
+        with self.camera_lock:
+            self.active = False
+            if self.encoder == "mjpeg":
+                self.picam2.stop_recording()  # stops every encoder
+            else:
+                for encoder, _ in self.extra_encoders:
+                    self.picam2.stop_encoder(encoder)
+                self.picam2.stop()
+
+    def add_encoder(self, encoder, output):
+        """Run another picamera2 encoder on the main stream while the camera is on"""
+        with self.camera_lock:
+            self.extra_encoders.append((encoder, output))
+            if self.active:
+                self.picam2.start_encoder(encoder, output, name="main")
+
+    def set_frame_rate(self, fps):
+        """Change the frame rate while streaming, up to the configured one"""
+        fps = max(min(fps, self.fps), 0.5)
         self.frame_interval = 1.0 / fps
+        duration = int(1_000_000 / fps)
+        self.rate_controls = {"FrameDurationLimits": (duration, duration)}
+        with self.camera_lock:
+            if self.active:
+                self.picam2.set_controls(self.rate_controls)
+
+    def keep_alive(self, seconds):
+        """Count as watched for a while, for clients without a long-lived connection"""
+        self.keep_alive_until = max(self.keep_alive_until, time.time() + seconds)
+
+    def _lock_exposure_later(self, delay=2):
+        timer = threading.Timer(delay, self._lock_exposure)
+        timer.daemon = True
+        timer.start()
+
+    def _remeter(self):
+        """After a restart: let AE/AWB carry on from the locked values, lock again once settled.
+
+        The locked values only make the first frames look right straight away;
+        the room may have got darker (or lighter) while the camera was paused.
+        """
+        with self.camera_lock:
+            if not self.active:
+                return
+            # Zero exposure time/gain means "chosen by AE" again
+            self.picam2.set_controls({"AeEnable": True, "AwbEnable": True,
+                                      "ExposureTime": 0, "AnalogueGain": 0})
+        self._lock_exposure_later()
+
+    def _lock_exposure(self):
+        """Freeze the settled exposure/gains so restarts come up looking the same"""
+        with self.camera_lock:
+            if not self.active:
+                return
+            md = self.picam2.capture_metadata()
+            controls = {}
+            for name in ("ExposureTime", "AnalogueGain", "ColourGains"):
+                if md.get(name) is not None:
+                    controls[name] = md[name]
+            controls["AeEnable"] = False
+            controls["AwbEnable"] = False
+            self.picam2.set_controls(controls)
+            self.locked_controls = controls
+
+    def viewer_count(self):
+        return (sum(broadcaster.subscribers for broadcaster in self.tiers.values())
+                + self.luma.subscribers)
 
-    def generate_mjpeg(self):
+    def _check_idle(self, now):
+        if self.viewer_count() or now < self.keep_alive_until:
+            self.last_viewer_time = now
+            if not self.active:
+                print("   📷 Viewer connected, resuming camera")
+                self._start_camera()
+                if self.lock_exposure and self.locked_controls:
+                    self._remeter()
+        elif (self.active and self.idle_timeout is not None
+              and now - self.last_viewer_time > self.idle_timeout):
+            print(f"   📷 No viewers for {self.idle_timeout}s, pausing camera")
+            self._stop_camera()
+
+    def _capture_loop(self):
+        try:
+            self._open_camera()
+        except Exception as e:
+            print(f"Camera error: {e}")
+            self.startup_error = str(e)
+            return
+
+        capture_seconds = CAPTURE_SECONDS.labels(self.name)
         last_frame_time = 0
-        while True:
+        while self.running:
             current_time = time.time()
-            if current_time - last_frame_time < self.frame_interval:
-                time.sleep(0.001)
+            wait = self.frame_interval - (current_time - last_frame_time)
+            if wait > 0:
+                time.sleep(wait)
+                continue
+
+            last_frame_time = current_time
+            try:
+                self._check_idle(current_time)
+            except Exception as e:
+                print(f"Camera error: {e}")
+                time.sleep(0.5)
+                continue
+            if not self.active:
                 continue
 
-            frame = self.picam2.capture_array()
-            buf = io.BytesIO()
-            Image.fromarray(frame).save(buf, format="JPEG", quality=70)
-            jpeg = buf.getvalue()
+            watched = [name for name in self.software_tiers if self.tiers[name].subscribers]
+            if not watched and not self.luma.subscribers:
+                continue
 
-            yield (b"--FRAME\r\n"
-                   b"Content-Type: image/jpeg\r\n"
-                   b"Content-Length: " + str(len(jpeg)).encode() + b"\r\n\r\n" +
-                   jpeg + b"\r\n")
+            try:
+                with capture_seconds.time():
+                    request = self.picam2.capture_request()
+                captured = time.time()
+                try:
+                    for name in watched:
+                        started = time.perf_counter()
+                        jpeg = self._encode_tier(request, name)
+                        ENCODE_SECONDS.labels(self.name, name).observe(time.perf_counter() - started)
+                        FRAME_BYTES.labels(self.name, name).observe(len(jpeg))
+                        self.tiers[name].publish(jpeg, captured)
+                    if self.luma.subscribers:
+                        self.luma.publish(self._downscaled_luma(request), captured)
+                finally:
+                    request.release()
+            except Exception as e:
+                print(f"Camera error: {e}")
+                time.sleep(0.5)
 
-            last_frame_time = current_time
+    def _downscaled_luma(self, request):
+        """Every luma_step-th pixel of the Y plane (or green channel), copied out"""
+        step = self.luma_step
+        if "low" in self.tiers:
+            stream, (width, height) = "lores", self.lores_resolution
+        else:
+            stream, (width, height) = "main", self.resolution
+        with MappedArray(request, stream) as m:
+            if stream == "lores" or self.capture_format == "YUV420":
+                return m.array[:height:step, :width:step].copy()
+            return m.array[:height:step, :width:step, 1].copy()
+
+    def _encode_tier(self, request, tier):
+        if tier == "low":
+            with MappedArray(request, "lores") as m:
+                return self.encode_yuv420(m.array, self.lores_resolution)
+        if self.capture_format == "YUV420":
+            # Encode the frame in place in the camera buffer, no numpy copy
+            with MappedArray(request, "main") as m:
+                return self.encode_yuv420(m.array, self.resolution)
+        buf = io.BytesIO()
+        Image.fromarray(request.make_array("main")).save(buf, format="JPEG", quality=self.quality)
+        return buf.getvalue()
+
+    def encode_yuv420(self, array, size):
+        # Planar YUV420: full size Y rows, then the U and V planes at half
+        # width/height, each row half the stride of a Y row
+        width, height = size
+        y = array[:height, :width]
+        half_rows = array.reshape((array.shape[0] * 2, array.strides[0] // 2))
+        u = half_rows[2 * height:2 * height + height // 2, :width // 2]
+        v = half_rows[2 * height + height // 2:, :width // 2]
+        return simplejpeg.encode_jpeg_yuv_planes(y, u, v, quality=self.quality)
 
     def stop(self):
-        self.picam2.stop()
\ No newline at end of file
+        self.running = False
+        self.thread.join(timeout=2)
+        if self.active:
+            self._stop_camera()
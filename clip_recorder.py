@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+import os
+import time
+import wave
+import queue
+import threading
+from collections import deque
+
+
+class ClipRecorder:
+    """Keeps the last few seconds of video/audio in memory and saves a clip on motion.
+
+    The pre-roll rings have a fixed size, a clip in progress is capped at
+    max_clip_seconds, and files are written by a separate thread so the live
+    stream never waits on the SD card.
+    """
+
+    def __init__(self, camera, audio=None, out_dir="/home/glen/clips", pre_seconds=5,
+                 post_seconds=10, max_clip_seconds=60, tier="low"):
+        self.camera = camera
+        self.audio = audio
+        self.out_dir = out_dir
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.max_clip_seconds = max_clip_seconds
+        # The small tier by default: the pre-roll runs all the time, and a 720p
+        # software encode around the clock would cost far more than it's worth
+        self.tier = tier
+
+        fps = 1.0 / camera.frame_interval
+        self.frames = deque(maxlen=int(pre_seconds * fps))  # (timestamp, jpeg)
+        self.max_clip_frames = int(max_clip_seconds * fps)
+        self.audio_blocks = deque()  # (timestamp, pcm)
+        self.audio_bytes = 0
+        if audio is not None:
+            self.audio_budget = int(pre_seconds * audio.RATE * audio.CHANNELS * 2)
+
+        self.lock = threading.Lock()
+        self.clip = None
+        self.deadline = 0
+        self.writer_queue = queue.Queue(maxsize=2)
+        self.running = False
+
+    def start(self):
+        """Start filling the pre-roll and the background writer"""
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+        except OSError as e:
+            print(f"   Clip recording disabled, can't use {self.out_dir}: {e}")
+            return
+        self.running = True
+        threading.Thread(target=self._video_loop, daemon=True).start()
+        if self.audio is not None:
+            threading.Thread(target=self._audio_loop, daemon=True).start()
+        threading.Thread(target=self._writer_loop, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def trigger(self):
+        """Motion callback: start a clip with the pre-roll, or extend the current one"""
+        now = time.time()
+        with self.lock:
+            if self.clip is None:
+                self.clip = {
+                    'started': now,
+                    'frames': list(self.frames),
+                    'audio': [block for block in self.audio_blocks],
+                }
+                print("   🔴 Recording clip...")
+            self.deadline = min(now + self.post_seconds,
+                                self.clip['started'] + self.max_clip_seconds)
+
+    def _video_loop(self):
+        broadcaster = self.camera.tier(self.tier)
+        broadcaster.subscribe()
+        sequence = 0
+        try:
+            while self.running:
+                new_sequence, jpeg = broadcaster.wait_for_frame(sequence, timeout=1)
+                if new_sequence == sequence:
+                    continue
+                sequence = new_sequence
+                item = (time.time(), jpeg)
+                with self.lock:
+                    self.frames.append(item)
+                    if self.clip is not None:
+                        if len(self.clip['frames']) < self.max_clip_frames:
+                            self.clip['frames'].append(item)
+                        self._finish_if_due(item[0])
+        finally:
+            broadcaster.unsubscribe()
+
+    def _audio_loop(self):
+        ring = self.audio.ring
+        ring.subscribe()
+        try:
+            cursor = ring.latest_cursor()
+            while self.running:
+                cursor, data = ring.read(cursor, timeout=1)
+                if not data:
+                    continue
+                item = (time.time(), data)
+                with self.lock:
+                    self.audio_blocks.append(item)
+                    self.audio_bytes += len(data)
+                    while self.audio_bytes > self.audio_budget:
+                        self.audio_bytes -= len(self.audio_blocks.popleft()[1])
+                    if self.clip is not None:
+                        self.clip['audio'].append(item)
+                        self._finish_if_due(item[0])
+        finally:
+            ring.unsubscribe()
+
+    def _finish_if_due(self, now):
+        # Called with self.lock held
+        if now < self.deadline:
+            return
+        clip, self.clip = self.clip, None
+        try:
+            self.writer_queue.put_nowait(clip)
+        except queue.Full:
+            print("   ⚠️ Clip writer busy, clip dropped")
+
+    def _writer_loop(self):
+        while self.running:
+            clip = self.writer_queue.get()
+            name = time.strftime("clip-%Y%m%d-%H%M%S", time.localtime(clip['started']))
+            path = os.path.join(self.out_dir, name)
+            try:
+                # MJPEG is just the JPEGs back to back, VLC/ffmpeg play it directly
+                with open(path + ".mjpeg", "wb") as f:
+                    for _, jpeg in clip['frames']:
+                        f.write(jpeg)
+                if clip['audio']:
+                    with wave.open(path + ".wav", "wb") as w:
+                        w.setnchannels(self.audio.CHANNELS)
+                        w.setsampwidth(2)
+                        w.setframerate(self.audio.RATE)
+                        w.writeframes(b"".join(data for _, data in clip['audio']))
+                print(f"   💾 Saved {name} ({len(clip['frames'])} frames)")
+            except OSError as e:
+                print(f"Clip write error: {e}")
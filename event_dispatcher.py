@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+import time
+import queue
+import threading
+import metrics
+
+CALLBACK_SECONDS = metrics.histogram(
+    "motion_callback_seconds", "Time spent in each motion callback", ["source"])
+CALLBACK_RESULTS = metrics.counter(
+    "event_callbacks_total", "Detector callback deliveries by outcome",
+    ["source", "callback", "result"])
+
+
+def callback_name(callback):
+    return getattr(callback, "__qualname__", None) or repr(callback)
+
+
+class _Subscriber:
+    def __init__(self, callback):
+        self.callback = callback
+        self.name = callback_name(callback)
+        self.queued = False    # waiting in the queue
+        self.running = False   # a worker is inside the callback
+        self.again = False     # another event arrived while running
+        self.started = 0.0
+        self.timed_out = False
+        self.counts = {"delivered": 0, "coalesced": 0, "dropped": 0, "timeout": 0, "error": 0}
+
+
+class EventDispatcher:
+    """Runs detector callbacks on a small worker pool so detection never waits on them.
+
+    dispatch() only marks subscribers as due and returns. A subscriber is never
+    called twice at once and has at most one call queued plus one follow-up, so
+    a burst of events while it is busy becomes a single extra call (coalesced).
+    When the bounded queue is full the event is dropped for that subscriber. A
+    callback still running after `timeout` seconds is counted and its worker
+    replaced, so one stuck callback can't starve the others.
+    """
+
+    def __init__(self, source, workers=2, max_queue=32, timeout=5.0):
+        self.source = source
+        self.timeout = timeout
+        self.subscribers = []
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.workers = 0
+        self.target_workers = workers
+        for _ in range(workers):
+            self._add_worker()
+        threading.Thread(target=self._watchdog, daemon=True).start()
+
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers.append(_Subscriber(callback))
+
+    def dispatch(self):
+        """Schedule every callback, returns immediately"""
+        for subscriber in list(self.subscribers):
+            with self.lock:
+                if subscriber.queued:
+                    result = "coalesced"
+                elif subscriber.running:
+                    result = "coalesced" if subscriber.again else None
+                    subscriber.again = True
+                else:
+                    try:
+                        self.queue.put_nowait(subscriber)
+                        subscriber.queued = True
+                        result = None
+                    except queue.Full:
+                        result = "dropped"
+                if result:
+                    subscriber.counts[result] += 1
+            if result:
+                CALLBACK_RESULTS.labels(self.source, subscriber.name, result).inc()
+
+    def stats(self):
+        """Per-callback delivery counts"""
+        with self.lock:
+            return {s.name: dict(s.counts, running=s.running) for s in self.subscribers}
+
+    def _add_worker(self):
+        self.workers += 1
+        threading.Thread(target=self._worker_loop, daemon=True).start()
+
+    def _worker_loop(self):
+        while True:
+            subscriber = self.queue.get()
+            with self.lock:
+                subscriber.queued = False
+                subscriber.running = True
+            while True:
+                subscriber.started = time.time()
+                result = "delivered"
+                try:
+                    with CALLBACK_SECONDS.labels(self.source).time():
+                        subscriber.callback()
+                except Exception as e:
+                    print(f"{self.source} callback {subscriber.name} failed: {e}")
+                    result = "error"
+                with self.lock:
+                    subscriber.counts[result] += 1
+                    again, subscriber.again = subscriber.again, False
+                    subscriber.running = again
+                    subscriber.timed_out = False
+                CALLBACK_RESULTS.labels(self.source, subscriber.name, result).inc()
+                if not again:
+                    break
+
+            # A replacement was started while this one was stuck, one of them goes
+            with self.lock:
+                if self.workers > self.target_workers:
+                    self.workers -= 1
+                    return
+
+    def _watchdog(self):
+        while True:
+            time.sleep(min(self.timeout / 2, 1.0))
+            now = time.time()
+            with self.lock:
+                for subscriber in self.subscribers:
+                    if (subscriber.running and not subscriber.timed_out
+                            and now - subscriber.started > self.timeout):
+                        subscriber.timed_out = True
+                        subscriber.counts["timeout"] += 1
+                        print(f"{self.source} callback {subscriber.name} is taking over "
+                              f"{self.timeout}s, starting another worker")
+                        CALLBACK_RESULTS.labels(self.source, subscriber.name, "timeout").inc()
+                        self._add_worker()
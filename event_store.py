@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+
+
+# === Project notes ============================================================
+# Motion/sound history on disk, one append-only file per local day
+# (events-YYYY-MM-DD.bin) of fixed 16-byte records in time order:
+#   timestamp float64 | value float32 (score, dBFS) | source uint32
+# Writes are batched (every flush_interval s) and fsync'd at most every
+# fsync_interval s, so the SD card sees a handful of writes per minute.
+# Queries find the day files in range and binary search (np.searchsorted)
+# inside them; bucketed counts come from per-day, per-minute summaries
+# (np.bincount) cached in memory, so months of history sum ~1440 numbers a day
+# (the part minutes at either end of the range are counted from the records).
+# ==============================================================================
+
+RECORD = np.dtype([("timestamp", "<f8"), ("value", "<f4"), ("source", "<u4")])
+SOURCES = ("pir", "camera", "sound")
+BUCKETS = {"minute": 60, "hour": 3600, "day": 86400}
+MAX_BUCKETS = 5000
+LATEST_TIME = 253402214400  # 9999-12-31, as far as local dates go
+
+
+def day_name(timestamp):
+    return time.strftime("%Y-%m-%d", time.localtime(timestamp))
+
+
+def day_start(day):
+    return time.mktime(time.strptime(day, "%Y-%m-%d"))
+
+
+def next_day_start(day):
+    t = time.strptime(day, "%Y-%m-%d")
+    return time.mktime((t.tm_year, t.tm_mon, t.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+
+
+def parse_time(value, default):
+    """Unix seconds or a local ISO time ("2026-10-18T22:00"), default when empty"""
+    if not value:
+        return default
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = datetime.fromisoformat(value).timestamp()
+    if not math.isfinite(seconds) or not 0 <= seconds <= LATEST_TIME:
+        raise ValueError(f"time out of range: {value}")
+    return seconds
+
+
+def parse_bucket(value):
+    """"minute", "hour", "day" or seconds (a multiple of 60), None for raw events"""
+    if not value:
+        return None
+    seconds = BUCKETS.get(value)
+    if seconds is None:
+        seconds = int(value)
+    if seconds < 60 or seconds % 60:
+        raise ValueError("bucket must be a whole number of minutes")
+    return seconds
+
+
+class EventStore:
+    def __init__(self, directory="/home/glen/events", flush_interval=5, fsync_interval=60,
+                 cached_days=400):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.cached_days = cached_days
+
+        self.pending = []
+        self.lock = threading.Lock()       # pending
+        self.file_lock = threading.Lock()  # day files
+        self.files = {}                    # day -> open append handle
+        self.last_fsync = time.time()
+        self.summaries = OrderedDict()     # day -> (file size, day start, per-minute counts)
+        self.summary_lock = threading.Lock()
+        self.enabled = True
+        self.running = False
+
+    def start(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError as e:
+            print(f"   Event log disabled, can't use {self.directory}: {e}")
+            self.enabled = False
+            return None
+        self.running = True
+        thread = threading.Thread(target=self._writer_loop, daemon=True)
+        thread.start()
+        return thread
+
+    def record(self, source, value=0.0):
+        """Queue one event, it reaches the disk with the next batch"""
+        with self.lock:
+            self.pending.append((time.time(), value, SOURCES.index(source)))
+
+    def _path(self, day):
+        return os.path.join(self.directory, f"events-{day}.bin")
+
+    def _writer_loop(self):
+        while self.running:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush(sync=time.time() - self.last_fsync >= self.fsync_interval)
+            except OSError as e:
+                print(f"Event log error: {e}")
+
+    def flush(self, sync=False):
+        """Append the pending events to their day files"""
+        if not self.enabled:
+            return
+        with self.lock:
+            batch, self.pending = self.pending, []
+        with self.file_lock:
+            if batch:
+                records = np.array(batch, dtype=RECORD)
+                days = [day_name(t) for t in records["timestamp"]]
+                for day in sorted(set(days)):
+                    handle = self.files.get(day)
+                    if handle is None:
+                        # Only today's (and maybe yesterday's) file stays open
+                        for old in [d for d in self.files if d < day]:
+                            self.files.pop(old).close()
+                        handle = self.files[day] = open(self._path(day), "ab")
+                    handle.write(records[[d == day for d in days]].tobytes())
+                    handle.flush()
+            if sync:
+                for handle in self.files.values():
+                    os.fsync(handle.fileno())
+                self.last_fsync = time.time()
+
+    def close(self):
+        self.running = False
+        self.flush(sync=True)
+        with self.file_lock:
+            for handle in self.files.values():
+                handle.close()
+            self.files = {}
+
+    def _days(self, since, until):
+        """Day names with a file, overlapping [since, until)"""
+        first, last = day_name(since), day_name(until)
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        days = [name[7:17] for name in names if name.startswith("events-") and name.endswith(".bin")]
+        return sorted(day for day in days if first <= day <= last)
+
+    def _load(self, day):
+        with self.file_lock, open(self._path(day), "rb") as f:
+            data = f.read()
+        # A power cut can leave half a record at the end, it is ignored
+        records = np.frombuffer(data[:len(data) // RECORD.itemsize * RECORD.itemsize],
+                                dtype=RECORD).copy()
+        # Normally already in order; not after the clock was set back (no RTC on a Pi)
+        if len(records) > 1 and np.any(np.diff(records["timestamp"]) < 0):
+            records.sort(order="timestamp")
+        return records
+
+    def _summary(self, day):
+        """(day start, counts[source, minute of the day]), cached until the file grows"""
+        size = os.path.getsize(self._path(day))
+        cached = self.summaries.get(day)
+        if cached is None or cached[0] != size:
+            start = day_start(day)
+            minutes = int(np.ceil((next_day_start(day) - start) / 60))  # 23/25 h with DST
+            records = self._load(day)
+            index = ((records["timestamp"] - start) // 60).astype(np.int64).clip(0, minutes - 1)
+            counts = np.zeros((len(SOURCES), minutes), dtype=np.uint32)
+            for number in range(len(SOURCES)):
+                mask = records["source"] == number
+                counts[number] = np.bincount(index[mask], minlength=minutes)
+            cached = (size, start, counts)
+            self.summaries[day] = cached
+            while len(self.summaries) > self.cached_days:
+                self.summaries.popitem(last=False)
+        self.summaries.move_to_end(day)
+        return cached[1], cached[2]
+
+    def _records(self, since, until, limit=None):
+        """(records in [since, until) up to limit, whether there were more)"""
+        chunks = []
+        total = 0
+        for day in self._days(since, until):
+            records = self._load(day)
+            stamps = records["timestamp"]
+            chunk = records[np.searchsorted(stamps, since):np.searchsorted(stamps, until)]
+            chunks.append(chunk)
+            total += len(chunk)
+            if limit is not None and total >= limit:
+                break
+        records = np.concatenate(chunks)[:limit] if chunks else np.zeros(0, dtype=RECORD)
+        return records, limit is not None and total > limit
+
+    def events(self, since, until, limit=10000):
+        """Raw events in [since, until), oldest first"""
+        self.flush()
+        records, truncated = self._records(since, until, limit)
+        return {
+            'since': since,
+            'until': until,
+            'truncated': truncated,
+            'events': [{
+                'timestamp': round(float(t), 3),
+                'time': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t)),
+                'source': SOURCES[source],
+                'value': round(float(value), 3),
+            } for t, value, source in records.tolist()],
+        }
+
+    def counts(self, since, until, bucket):
+        """Detections per source in bucket-second slots (aligned to local time) from since"""
+        self.flush()
+        offset = time.localtime(since).tm_gmtoff
+        start = (since + offset) // bucket * bucket - offset
+        slots = int(np.ceil((until - start) / bucket))
+        if slots > MAX_BUCKETS:
+            raise ValueError(f"more than {MAX_BUCKETS} buckets, use a bigger bucket")
+        totals = np.zeros((len(SOURCES), max(slots, 0)), dtype=np.int64)
+
+        # Whole minutes inside [since, until) come from the summaries, the part
+        # minutes at either end from the raw records
+        first_full = math.ceil(since / 60) * 60
+        last_full = max(math.floor(until / 60) * 60, first_full)
+        for day in self._days(first_full, last_full):
+            with self.summary_lock:
+                first_minute, counts = self._summary(day)
+            minute_starts = first_minute + 60 * np.arange(counts.shape[1])
+            keep = (minute_starts >= first_full) & (minute_starts < last_full)
+            slot = ((minute_starts[keep] - start) // bucket).astype(np.int64)
+            inside = (slot >= 0) & (slot < slots)
+            for number in range(len(SOURCES)):
+                totals[number] += np.bincount(slot[inside], weights=counts[number][keep][inside],
+                                              minlength=slots).astype(np.int64)
+        for edge_since, edge_until in ((since, min(first_full, until)), (max(last_full, since), until)):
+            if edge_since >= edge_until:
+                continue
+            records, _ = self._records(edge_since, edge_until)
+            slot = ((records["timestamp"] - start) // bucket).astype(np.int64)
+            for number in range(len(SOURCES)):
+                totals[number] += np.bincount(slot[records["source"] == number],
+                                              minlength=slots)[:slots]
+        return {
+            'since': since,
+            'until': until,
+            'bucket': bucket,
+            'buckets': [dict({
+                'start': start + i * bucket,
+                'time': time.strftime("%Y-%m-%d %H:%M", time.localtime(start + i * bucket)),
+            }, **{source: int(totals[n][i]) for n, source in enumerate(SOURCES)})
+                for i in range(slots)],
+        }
+
+    def query(self, since=None, until=None, bucket=None):
+        """/events: raw events, or counts per bucket; defaults to the last 24 h"""
+        until = parse_time(until, time.time())
+        since = parse_time(since, until - 86400)
+        bucket = parse_bucket(bucket)
+        if not self.enabled:
+            return {'since': since, 'until': until, 'events': []}
+        if bucket is None:
+            return self.events(since, until)
+        return self.counts(since, until, bucket)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+import io
+import os
+import time
+import types
+import threading
+import numpy as np
+from PIL import Image
+
+
+# === Project notes ============================================================
+# Stand-ins for picamera2, PyAudio and gpiozero so the monitor (and the
+# benchmark in benchmarks/) runs on any Linux box. Enable them with
+#
+#   BABY_MONITOR_FAKE_HARDWARE=1 python3 flask_app.py
+#
+# Camera: a bright square moving over a gradient, in the configured formats.
+#         The fake hardware MJPEG encoder reuses pre-encoded JPEGs (like the
+#         real one it costs no Python CPU) and tags each with its capture time
+#         in a JPEG comment so the benchmark can measure latency.
+# Audio:  a 440 Hz tone with a little noise, delivered in real time.
+# PIR:    fires every BABY_MONITOR_FAKE_PIR_INTERVAL seconds (default 30).
+# Only the parts of each library this project uses are implemented.
+# ==============================================================================
+
+LOOP_FRAMES = 16
+
+
+def _synthetic_frames(size, fmt):
+    width, height = size
+    yy, xx = np.mgrid[0:height, 0:width]
+    base = ((xx * 255 // max(width - 1, 1) + yy * 64 // max(height - 1, 1)) % 256).astype(np.uint8)
+    square = max(min(width, height) // 6, 2)
+    frames = []
+    for i in range(LOOP_FRAMES):
+        luma = base.copy()
+        x = (width - square) * i // LOOP_FRAMES
+        y = (height - square) // 2
+        luma[y:y + square, x:x + square] = 235
+        if fmt == "YUV420":
+            chroma = np.full((height // 2, width), 128, dtype=np.uint8)
+            frames.append(np.vstack((luma, chroma)))
+        else:
+            frames.append(np.dstack((luma, luma, luma)))
+    return frames
+
+
+def _jpeg(frame, fmt, size):
+    width, height = size
+    image = frame[:height] if fmt == "YUV420" else frame
+    buf = io.BytesIO()
+    Image.fromarray(image).save(buf, format="JPEG", quality=70)
+    return buf.getvalue()
+
+
+def tag_jpeg(jpeg, timestamp):
+    """Insert a COM segment holding the capture time right after the SOI marker"""
+    payload = f"ts={timestamp:.6f}".encode()
+    return jpeg[:2] + b"\xff\xfe" + (len(payload) + 2).to_bytes(2, "big") + payload + jpeg[2:]
+
+
+def jpeg_timestamp(jpeg):
+    """Capture time from tag_jpeg(), or None"""
+    if jpeg[2:4] != b"\xff\xfe":
+        return None
+    length = int.from_bytes(jpeg[4:6], "big")
+    payload = jpeg[6:4 + length]
+    if not payload.startswith(b"ts="):
+        return None
+    return float(payload[3:])
+
+
+# --- picamera2 ---------------------------------------------------------------
+
+class FakeRequest:
+    def __init__(self, arrays):
+        self.arrays = arrays
+
+    def make_array(self, name):
+        return self.arrays[name].copy()
+
+    def release(self):
+        pass
+
+
+class MappedArray:
+    def __init__(self, request, name):
+        self.array = request.arrays[name]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class Picamera2:
+    def __init__(self, camera_num=0):
+        self.camera_num = camera_num
+        self.config = None
+        self.started = False
+        self.local = threading.local()
+        self.encoders = []
+
+    def create_video_configuration(self, main=None, lores=None, buffer_count=4, controls=None):
+        return {
+            "main": dict(main or {"size": (1280, 720), "format": "XBGR8888"}),
+            "lores": dict(lores) if lores else None,
+            "buffer_count": buffer_count,
+            "controls": dict(controls or {}),
+        }
+
+    def configure(self, config):
+        self.config = config
+        self.fps = config["controls"].get("FrameRate", 30)
+        self.frames = {}
+        for name in ("main", "lores"):
+            stream = config[name]
+            if stream:
+                self.frames[name] = _synthetic_frames(stream["size"], stream["format"])
+
+    def start(self):
+        self.started = True
+
+    def stop(self):
+        self.started = False
+
+    def set_controls(self, controls):
+        limits = controls.get("FrameDurationLimits")
+        if limits:
+            self.fps = 1_000_000 / limits[1]
+
+    def capture_metadata(self):
+        return {"ExposureTime": 20000, "AnalogueGain": 2.0, "ColourGains": (1.8, 1.5)}
+
+    def _wait_for_frame(self):
+        # One sensor clock at FrameRate, every stream/encoder sees every frame
+        interval = 1.0 / self.fps
+        now = time.time()
+        due = (int(now / interval) + 1) * interval
+        if due <= getattr(self.local, "last_due", 0):
+            due += interval
+        time.sleep(max(due - now, 0))
+        self.local.last_due = due
+        return int(due / interval) % LOOP_FRAMES
+
+    def capture_request(self):
+        index = self._wait_for_frame()
+        return FakeRequest({name: frames[index] for name, frames in self.frames.items()})
+
+    def capture_array(self, name="main"):
+        return self.capture_request().make_array(name)
+
+    def start_recording(self, encoder, output):
+        self.start()
+        self.start_encoder(encoder, output)
+
+    def stop_recording(self):
+        self.stop_encoder()
+        self.stop()
+
+    def start_encoder(self, encoder, output, name="main"):
+        encoder.running = True
+        self.encoders.append(encoder)
+        if isinstance(encoder, MJPEGEncoder):
+            stream = self.config[name]
+            jpegs = [_jpeg(frame, stream["format"], stream["size"]) for frame in self.frames[name]]
+            threading.Thread(target=self._mjpeg_loop, args=(encoder, output, jpegs),
+                             daemon=True).start()
+
+    def stop_encoder(self, encoder=None):
+        for running in list(self.encoders):
+            if encoder is None or running is encoder:
+                running.running = False
+                self.encoders.remove(running)
+
+    def _mjpeg_loop(self, encoder, output, jpegs):
+        # Like picamera2: timestamps are sensor (monotonic) µs counted from the
+        # encoder's first frame, which it keeps in firsttimestamp
+        encoder.firsttimestamp = None
+        while encoder.running:
+            index = self._wait_for_frame()
+            sensor_us = int(time.monotonic() * 1_000_000)
+            if encoder.firsttimestamp is None:
+                encoder.firsttimestamp = sensor_us
+            output.outputframe(tag_jpeg(jpegs[index], time.time()), True,
+                               sensor_us - encoder.firsttimestamp)
+
+
+class MJPEGEncoder:
+    def __init__(self, bitrate=None):
+        self.running = False
+        self.firsttimestamp = None
+
+
+class H264Encoder:
+    """Accepted but produces nothing, there is no H.264 source without the Pi"""
+
+    def __init__(self, bitrate=None, repeat=False, iperiod=None):
+        self.running = False
+
+
+class Output:
+    def __init__(self, pts=None):
+        self.recording = False
+
+    def start(self):
+        self.recording = True
+
+    def stop(self):
+        self.recording = False
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        pass
+
+
+class FileOutput(Output):
+    def __init__(self, file=None, pts=None):
+        super().__init__(pts)
+        self.fileoutput = file
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        self.fileoutput.write(frame)
+
+
+# --- PyAudio -----------------------------------------------------------------
+
+class FakeInputStream:
+    def __init__(self, rate, frames_per_buffer):
+        self.rate = rate
+        t = np.arange(rate) / rate
+        tone = 3000 * np.sin(2 * np.pi * 440 * t) + np.random.normal(0, 200, rate)
+        self.loop = tone.astype(np.int16).tobytes()
+        self.position = 0
+        self.next_read_time = time.time()
+
+    def read(self, frames, exception_on_overflow=True):
+        self.next_read_time += frames / self.rate
+        delay = self.next_read_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        size = frames * 2
+        data = (self.loop + self.loop)[self.position:self.position + size]
+        self.position = (self.position + size) % len(self.loop)
+        return data
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakePyAudio:
+    def open(self, format=None, channels=1, rate=16000, input=True, frames_per_buffer=512,
+             input_device_index=None):
+        return FakeInputStream(rate, frames_per_buffer)
+
+    def terminate(self):
+        pass
+
+
+pyaudio = types.SimpleNamespace(PyAudio=FakePyAudio, paInt16=8, paInputOverflowed=-9981)
+
+
+# --- gpiozero ----------------------------------------------------------------
+
+class MotionSensor:
+    def __init__(self, pin, interval=None):
+        self.pin = pin
+        self.interval = interval or float(os.environ.get("BABY_MONITOR_FAKE_PIR_INTERVAL", 30))
+        self.motion_detected = False
+        self.when_motion = None
+        self.when_no_motion = None
+        threading.Thread(target=self._script, daemon=True).start()
+
+    def _script(self):
+        while True:
+            time.sleep(self.interval)
+            self.motion_detected = True
+            if self.when_motion:
+                self.when_motion()
+            time.sleep(2)
+            self.motion_detected = False
+            if self.when_no_motion:
+                self.when_no_motion()
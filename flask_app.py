@@ -1,66 +1,591 @@
 #!/usr/bin/env python3
+import os
 import time
-from flask import Flask, Response, send_file
-from camera_stream import CameraStream
-from motion_detector import MotionDetector
-from audio_stream import AudioStream
+from flask import Flask, Response, request, abort
+from camera_stream import snapshot_etag, etag_sequence, wait_timeout
+from hls_stream import start_hls
+from stream_controller import CpuScheduler
+from rooms import Room, GridView, open_cameras
+from static_assets import StaticAsset
+import metrics
 
-# Initialize components
-camera = CameraStream(resolution=(1280, 720), fps=15)
-audio = AudioStream(device_index=3)
-motion = MotionDetector(gpio_pin=17)
+# Rooms served by this Pi, each with its own camera (Picamera2 camera number),
+# microphone (PyAudio device index) and PIR (GPIO pin). The first room also
+# answers the plain /video, /audio, /motion ... routes; every room is at
+# /rooms/<id>/ and /rooms/<id>/video etc., and /grid/video shows them all.
+ROOMS = {
+    'nursery': dict(title='Nursery', camera_num=0, audio_device=3, pir_pin=17),
+}
+
+# CPU (in cores) all rooms' JPEG encoding may use together, shared out fairly
+ENCODE_CPU_BUDGET = 2.0
+
+# Run capture + encoding in a separate process (uses another core on a Pi 3/4/5)
+CAMERA_IN_SEPARATE_PROCESS = False
+
+# The next three need the camera/microphone all the time, so with any of them on
+# IDLE_TIMEOUT never pauses the camera or closes the microphone. Off by default.
+
+# Camera based motion detection next to the PIR (keeps the camera running)
+VIDEO_MOTION_DETECTION = False
+
+# Listen for crying on the microphone (keeps the microphone open)
+SOUND_DETECTION = False
+
+# Save a clip (5 s before + 10 s after) to CLIP_DIR whenever motion is detected
+# (keeps the camera's small stream and the microphone running for the pre-roll)
+CLIP_RECORDING = False
+CLIP_DIR = '/home/glen/clips'
+
+# Keep a history of PIR/camera/sound detections on disk for /events
+EVENT_LOG = True
+EVENT_DIR = '/home/glen/events'
+
+# Live HLS (H.264) at /hls/stream.m3u8, segments kept in memory only
+HLS_STREAMING = False
+
+# Adjust JPEG quality/frame rate/tier to load, and drop to 2 fps while the room is still
+ADAPTIVE_STREAMING = True
+
+# Seconds without any viewer/listener before the camera/mic are switched off
+IDLE_TIMEOUT = 30
+
+# Played by the page on motion, read into memory once at startup
+ALERT_PATH = '/home/glen/static/alert.mp3'
+
+camera_settings = dict(resolution=(1280, 720), fps=15, capture_format="YUV420", encoder="mjpeg",
+                       lock_exposure=True)
+
+# Initialize components, every room's camera first: capture processes are
+# forked from here, before any other thread is running
+cameras = open_cameras(ROOMS, camera_settings, CAMERA_IN_SEPARATE_PROCESS, IDLE_TIMEOUT)
+
+# The first room keeps the plain clip/event directories, the others get a subdirectory
+rooms = {}
+for number, (room_id, settings) in enumerate(ROOMS.items()):
+    settings = {name: value for name, value in settings.items() if name != 'camera_num'}
+    rooms[room_id] = Room(
+        room_id, cameras[room_id], idle_timeout=IDLE_TIMEOUT,
+        clip_dir=CLIP_DIR if number == 0 else os.path.join(CLIP_DIR, room_id),
+        event_dir=EVENT_DIR if number == 0 else os.path.join(EVENT_DIR, room_id),
+        **settings)
+main_room = next(iter(rooms.values()))
+camera, audio, motion = main_room.camera, main_room.audio, main_room.motion
+event_store = main_room.event_store
+grid = GridView(list(rooms.values())) if len(rooms) > 1 else None
+hls = start_hls(camera) if HLS_STREAMING else None
+scheduler = CpuScheduler({room.id: room.controller for room in rooms.values()},
+                         budget=ENCODE_CPU_BUDGET)
+
+# Camera, microphone and PIR all open in the background, so the page is served
+# straight away; /health reports each one until it is ready
+STARTED = time.time()
+components = {}
+for room in rooms.values():
+    prefix = '' if room is main_room else room.id + '/'
+    for name, component in room.components().items():
+        components[prefix + name] = component
+
+def health_status():
+    """(everything ready?, per-component report) for /health"""
+    states = {}
+    for name, component in components.items():
+        if component.ready.is_set():
+            states[name] = 'ready'
+        elif component.startup_error:
+            states[name] = 'failed: ' + component.startup_error
+        else:
+            states[name] = 'starting'
+    ready = all(state == 'ready' for state in states.values())
+    return ready, {'ready': ready, 'uptime': round(time.time() - STARTED, 2), 'components': states}
 
 app = Flask(__name__)
 
+# Gauges for /metrics, only evaluated when scraped
+def video_sources():
+    return [(room.id, room.camera) for room in rooms.values()] + ([('grid', grid)] if grid else [])
+
+metrics.gauge_function(
+    "stream_clients", "Connected streaming clients",
+    lambda: [((name, "video"), len(source.clients)) for name, source in video_sources()]
+    + [((room.id, "audio"), room.audio.listeners) for room in rooms.values()],
+    ["room", "kind"])
+metrics.gauge_function(
+    "mjpeg_client_fps", "Effective frame rate per MJPEG client",
+    lambda: [((name, c['client'], c['id'], c['tier']), c['fps'])
+             for name, source in video_sources() for c in source.client_stats()],
+    ["room", "client", "connection", "tier"])
+metrics.gauge_function(
+    "mjpeg_client_frames_dropped", "Frames skipped because the MJPEG client was too slow",
+    lambda: [((name, c['client'], c['id'], c['tier']), c['frames_dropped'])
+             for name, source in video_sources() for c in source.client_stats()],
+    ["room", "client", "connection", "tier"])
+
 # Motion alert callback
 def play_motion_alert():
     print("   Playing motion alert...")
     # In a real implementation, this would trigger something
 
-motion.add_callback(play_motion_alert)
+# Sound alert callback
+def play_sound_alert():
+    print("   Playing sound alert...")
 
-# Start motion detection
-motion.start()
+def start_room(room):
+    motion, video_motion, sound = room.motion, room.video_motion, room.sound
+    motion.add_callback(play_motion_alert)
+    video_motion.add_callback(play_motion_alert)
+    sound.add_callback(play_sound_alert)
+    if CLIP_RECORDING:
+        room.recorder.start()
+        motion.add_callback(room.recorder.trigger)
+        video_motion.add_callback(room.recorder.trigger)
+        sound.add_callback(room.recorder.trigger)
 
-# HTML page (same as before, shortened)
+    # Start motion detection
+    motion.start()
+    if VIDEO_MOTION_DETECTION:
+        video_motion.start()
+    if SOUND_DETECTION:
+        sound.start()
+
+    # Detection history, the value is the camera's motion score / the sound level
+    def log_pir_motion():
+        room.event_store.record('pir')
+
+    def log_camera_motion():
+        room.event_store.record('camera', video_motion.score)
+
+    def log_sound():
+        room.event_store.record('sound', sound.levels['rms_db'])
+
+    if EVENT_LOG and room.event_store.start():
+        motion.add_callback(log_pir_motion)
+        video_motion.add_callback(log_camera_motion)
+        sound.add_callback(log_sound)
+    if ADAPTIVE_STREAMING:
+        room.controller.watch(motion)
+        room.controller.watch(video_motion)
+        room.controller.watch(sound)
+        room.controller.start()
+
+for room in rooms.values():
+    start_room(room)
+# A single room keeps the whole budget to itself
+if ADAPTIVE_STREAMING and len(rooms) > 1:
+    scheduler.start()
+
+# HTML page
 HTML_PAGE = """
 <!DOCTYPE html>
 <html>
-... your HTML from before ...
+<head>
+    <title>G&S Baby Monitor</title>
+    <style>
+        body {
+            background: black;
+            color: white;
+            font-family: Arial;
+            text-align: center;
+            padding: 20px;
+        }
+        #video {
+            width: 80%;
+            max-width: 800px;
+            border: 3px solid #444;
+            border-radius: 10px;
+            display: block;
+            margin: 0 auto;
+            transform: rotate(180deg);
+        }
+        .audio-container {
+            width: 90%;
+            max-width: 900px;
+            margin: 20px auto;
+            background: #2c3e50;
+            padding: 20px;
+            border-radius: 10px;
+        }
+        audio {
+            width: 100%;
+            height: 50px;
+        }
+        
+        .status {
+            background: #27ae60;
+            padding: 20px;
+            margin: 20px auto;
+            width: 80%;
+            max-width: 800px;
+            border-radius: 10px;
+            font-size: 20px;
+        }
+        .alert {
+            background: #e74c3c;
+            animation: blink 1s infinite;
+        }
+        @keyframes blink {
+            0% { opacity: 1; }
+            50% { opacity: 0.5; }
+            100% { opacity: 1; }
+        }
+        button {
+            background: #3498db;
+            color: white;
+            border: none;
+            padding: 15px 30px;
+            margin: 10px;
+            border-radius: 5px;
+            font-size: 18px;
+            cursor: pointer;
+        }
+        .controls {
+            margin: 20px;
+        }
+        #rooms a {
+            color: white;
+            margin: 0 10px;
+        }
+    </style>
+</head>
+<body>
+    <h1>👶 Baby Monitor with Live Audio</h1>
+    <p id="rooms"></p>
+
+    <img id="video" alt="Live Feed">
+
+<div class="audio-container">
+    <h3>🎤 Live Audio Stream</h3>
+    <audio id="audio-stream" controls>
+        <source src="audio" type="audio/x-wav">
+    </audio>
+    <p><small>Volume: <input type="range" id="volume" min="0" max="10" step="0.1" value="0.5" 
+           onchange="document.getElementById('audio-stream').volume = this.value;"></small></p>
+    <p id="audio-help" style="font-size: 12px; color: #95a5a6;">
+        <span id="desktop-hint">Click play to start audio</span>
+        <span id="mobile-hint" style="display:none; color:#f39c12;">
+            📱 Mobile: You may need to tap twice to start audio
+        </span>
+    </p>
+</div>
+
+    <div id="motion-status" class="status">
+        Motion: <span id="motion-text">No</span>
+    </div>
+
+    <p>Last motion: <span id="last-motion">Never</span></p>
+
+    <div class="controls">
+        <button onclick="document.getElementById('alert-sound').play().then(() => { document.getElementById('alert-sound').pause(); })">
+            🔊 Enable Motion Alerts
+        </button>
+        <button onclick="takeSnapshot()">📸 Take Photo</button>
+        <button onclick="toggleAudio()" id="audio-btn">🔇 Mute Audio</button>
+    </div>
+
+    <!-- Motion alert sound -->
+    <audio id="alert-sound" preload="auto" style="display:none;">
+        <source src="/alert.mp3" type="audio/mpeg">
+    </audio>
+
+    <script>
+        let audioMuted = false;
+
+        // Phones get the small lores stream, bigger screens the full one unless
+        // the stream controller moves "auto" viewers down to save CPU/bandwidth
+        document.getElementById('video').src =
+            window.innerWidth < 700 ? 'video?tier=low' : 'video?tier=auto';
+
+        // The same page serves every room: at / it is the first room, at /rooms/<id>/
+        // the relative URLs (video, audio, motion/events...) point at that room
+        fetch('/rooms').then(r => r.json()).then(data => {
+            if (data.rooms.length < 2) return;
+            const nav = document.getElementById('rooms');
+            for (const room of data.rooms) {
+                const link = document.createElement('a');
+                link.href = '/rooms/' + room.id + '/';
+                link.textContent = room.title;
+                nav.appendChild(link);
+            }
+            const grid = document.createElement('a');
+            grid.href = '/grid/video';
+            grid.textContent = 'All rooms';
+            nav.appendChild(grid);
+        });
+
+        function toggleAudio() {
+            const audio = document.getElementById('audio-stream');
+            const btn = document.getElementById('audio-btn');
+
+            if (audioMuted) {
+                audio.muted = false;
+                btn.textContent = "🔇 Mute Audio";
+                audioMuted = false;
+            } else {
+                audio.muted = true;
+                btn.textContent = "🔊 Unmute Audio";
+                audioMuted = true;
+            }
+        }
+
+        function showMotion(data) {
+            const status = document.getElementById('motion-status');
+            const text = document.getElementById('motion-text');
+            const last = document.getElementById('last-motion');
+
+            if (data.motion) {
+                text.textContent = "DETECTED! 🚨";
+                status.className = "status alert";
+                document.getElementById('alert-sound').play();
+            } else {
+                text.textContent = "No";
+                status.className = "status";
+            }
+
+            last.textContent = data.last_time;
+        }
+
+        function takeSnapshot() {
+            // The server returns the frame it already encoded, at full resolution
+            const link = document.createElement('a');
+            link.download = 'baby-' + new Date().toISOString().replace(/[:.]/g, '-') + '.jpg';
+            link.href = 'snapshot.jpg?t=' + Date.now();
+            link.click();
+        }
+
+        // Motion changes are pushed by the server, the browser reconnects on its own
+        const motionEvents = new EventSource('motion/events');
+        motionEvents.onmessage = (event) => showMotion(JSON.parse(event.data));
+
+        // Auto-reconnect audio if it stops
+        setInterval(() => {
+            const audio = document.getElementById('audio-stream');
+            if (audio.error || audio.ended) {
+                console.log('Reconnecting audio...');
+                audio.load();
+            }
+        }, 10000);
+        
+               // Mobile detection for audio
+        if (/iPhone|iPad|iPod|Android/i.test(navigator.userAgent)) {
+            document.getElementById('mobile-hint').style.display = 'inline';
+            document.getElementById('desktop-hint').style.display = 'none';
+            
+            // Mobile Safari workaround
+            let audioTapped = false;
+            document.getElementById('audio-stream').addEventListener('click', function() {
+                if (!audioTapped) {
+                    audioTapped = true;
+                    this.play().catch(e => {
+                        console.log("Mobile audio requires user gesture");
+                    });
+                }
+            });
+        }
+        
+        // Volume control
+        document.getElementById('volume').oninput = function() {
+            document.getElementById('audio-stream').volume = this.value;
+        };
+         
+    </script>
+</body>
 </html>
 """
 
+# The page and alert sound are compressed once and served from memory with ETags;
+# the page is revalidated on every load (a 304), the sound cached for a day
+page_asset = StaticAsset(HTML_PAGE.encode(), 'text/html; charset=utf-8')
+alert_asset = StaticAsset.from_file(ALERT_PATH, 'audio/mpeg', 'public, max-age=86400')
+
 # Routes
-@app.route('/')
-def home():
-    return HTML_PAGE
+def get_room(room_id):
+    """The room a /rooms/<id>/... URL names, the first room for the plain routes"""
+    if room_id is None:
+        return main_room
+    room = rooms.get(room_id)
+    if room is None:
+        abort(404)
+    return room
+
+def asset_response(asset):
+    if asset is None:
+        return 'Not Found', 404
+    status, headers, body = asset.respond(
+        request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'),
+        request.headers.get('Range'), request.headers.get('If-Range'))
+    return Response(body, status=status, headers=headers)
 
-@app.route('/video')
-def video():
+def mjpeg_response(source):
     return Response(
-        camera.generate_mjpeg(),
+        source.generate_mjpeg(request.remote_addr, request.environ.get('werkzeug.socket'),
+                              tier=request.args.get('tier', 'high')),
         mimetype="multipart/x-mixed-replace; boundary=FRAME",
         headers={"Cache-Control": "no-cache"}
     )
 
-@app.route('/audio')
-def audio_stream():
+@app.route('/', defaults={'room_id': None})
+@app.route('/rooms/<room_id>/')
+def home(room_id):
+    get_room(room_id)
+    return asset_response(page_asset)
+
+@app.route('/rooms')
+def list_rooms():
+    return {
+        'rooms': [room.summary() for room in rooms.values()],
+        'cpu': scheduler.status(),
+    }
+
+@app.route('/video', defaults={'room_id': None})
+@app.route('/rooms/<room_id>/video')
+def video(room_id):
+    return mjpeg_response(get_room(room_id).camera)
+
+@app.route('/grid/video')
+def grid_video():
+    if grid is None:
+        return 'Only one room, use /video', 404
+    return mjpeg_response(grid)
+
+@app.route('/video/clients', defaults={'room_id': None})
+@app.route('/rooms/<room_id>/video/clients')
+def video_clients(room_id):
+    return {'clients': get_room(room_id).camera.client_stats()}
+
+@app.route('/snapshot.jpg', defaults={'room_id': None})
+@app.route('/rooms/<room_id>/snapshot.jpg')
+def snapshot(room_id):
+    # The frame viewers already got, no extra encode. ETag is boot-tier-sequence;
+    # ?wait_newer=<ETag or sequence> long-polls up to ?timeout= seconds for the next one
+    camera = get_room(room_id).camera
+    tier = request.args.get('tier', 'high')
+    if tier not in camera.tiers:
+        tier = 'high'
+    newer_than = etag_sequence(request.args.get('wait_newer', '0'), tier)
+    try:
+        timeout = wait_timeout(request.args.get('timeout')) if newer_than else 5
+    except ValueError:
+        return {'error': 'timeout must be a number of seconds'}, 400
+    sequence, jpeg = camera.snapshot(tier, newer_than, timeout)
+    if jpeg is None and not newer_than:
+        return Response('Camera is starting', status=503, headers={'Retry-After': '1'})
+
+    response = Response(jpeg, mimetype='image/jpeg',
+                        headers={'Cache-Control': 'no-cache', 'X-Frame-Sequence': str(sequence)})
+    response.set_etag(snapshot_etag(tier, sequence or newer_than))
+    if jpeg is None or request.if_none_match.contains(snapshot_etag(tier, sequence)):
+        response.status_code = 304
+        response.data = b''
+    return response
+
+@app.route('/video/quality', defaults={'room_id': None}, methods=['GET', 'POST', 'DELETE'])
+@app.route('/rooms/<room_id>/video/quality', methods=['GET', 'POST', 'DELETE'])
+def video_quality(room_id):
+    # POST {"quality": [50, 80], "fps": 15, "tier": "high", "max_kbps": 2000} pins limits,
+    # DELETE goes back to the defaults
+    controller = get_room(room_id).controller
+    try:
+        if request.method == 'POST':
+            controller.pin(**(request.get_json(force=True) or {}))
+        elif request.method == 'DELETE':
+            controller.reset()
+    except (TypeError, ValueError) as e:
+        return {'error': str(e)}, 400
+    return controller.status()
+
+@app.route('/audio', defaults={'room_id': None})
+@app.route('/rooms/<room_id>/audio')
+def audio_stream(room_id):
     return Response(
-        audio.generate_audio(),
+        get_room(room_id).audio.generate_audio(request.args.get('codec', 'pcm')),
         mimetype='audio/x-wav',
         headers={'Cache-Control': 'no-cache'}
     )
 
-@app.route('/motion')
-def get_motion():
+@app.route('/motion', defaults={'room_id': None})
+@app.route('/rooms/<room_id>/motion')
+def get_motion(room_id):
+    room = get_room(room_id)
     return {
-        'motion': motion.motion_detected,
-        'last_time': motion.last_motion_time
+        'motion': room.motion.motion_detected,
+        'last_time': room.motion.last_motion_time,
+        'count': room.motion.event_count,
+        'callbacks': room.motion.dispatcher.stats(),
+        'video_motion': room.video_motion.motion_detected,
+        'video_score': round(room.video_motion.score, 4)
     }
 
+@app.route('/motion/events', defaults={'room_id': None})
+@app.route('/rooms/<room_id>/motion/events')
+def motion_events(room_id):
+    return Response(
+        get_room(room_id).motion.generate_events(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/sound', defaults={'room_id': None})
+@app.route('/rooms/<room_id>/sound')
+def get_sound(room_id):
+    sound = get_room(room_id).sound
+    try:
+        seconds = int(request.args.get('seconds', 60))
+        if seconds < 0:
+            raise ValueError
+    except ValueError:
+        return {'error': 'seconds must be a whole number of seconds'}, 400
+    return {
+        'sound': sound.sound_detected,
+        'last_time': sound.last_sound_time,
+        'levels': sound.levels,
+        'history': sound.level_history(seconds=seconds)
+    }
+
+@app.route('/events', defaults={'room_id': None})
+@app.route('/rooms/<room_id>/events')
+def get_events(room_id):
+    # ?since=&until= (unix seconds or local ISO time, default last 24 h), raw events or,
+    # with ?bucket=minute|hour|day|<seconds>, detections per source per bucket
+    event_store = get_room(room_id).event_store
+    try:
+        return event_store.query(request.args.get('since'), request.args.get('until'),
+                                 request.args.get('bucket'))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+@app.route('/hls/stream.m3u8')
+def hls_playlist():
+    if hls is None:
+        return 'HLS is disabled', 404
+    # HLS players only poll, so every playlist fetch keeps the camera awake
+    camera.keep_alive(30)
+    if not hls.wait_for_playlist(timeout=10):
+        return 'Stream starting, try again', 503
+    return Response(
+        hls.playlist(),
+        mimetype='application/vnd.apple.mpegurl',
+        headers={'Cache-Control': 'no-cache'}
+    )
+
+@app.route('/hls/segment<int:number>.ts')
+def hls_segment(number):
+    data = hls.segment(number) if hls is not None else None
+    if data is None:
+        return 'Segment expired', 404
+    return Response(data, mimetype='video/mp2t', headers={'Cache-Control': 'max-age=60'})
+
+@app.route('/health')
+def health():
+    ready, report = health_status()
+    return report, 200 if ready else 503
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/alert.mp3')
 def serve_alert():
-    return send_file('/home/glen/static/alert.mp3', mimetype='audio/mpeg')
+    return asset_response(alert_asset)
 
 if __name__ == "__main__":
     print("👶 Baby Monitor Starting...")
@@ -68,5 +593,7 @@ if __name__ == "__main__":
         app.run(host="0.0.0.0", port=8080, threaded=True, debug=False)
     except KeyboardInterrupt:
         print("\n🛑 Stopping...")
-        camera.stop()
-        audio.cleanup()
\ No newline at end of file
+        if grid is not None:
+            grid.stop()
+        for room in rooms.values():
+            room.stop()
\ No newline at end of file
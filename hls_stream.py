@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+import io
+import os
+import math
+import threading
+from collections import deque
+from fractions import Fraction
+if os.environ.get("BABY_MONITOR_FAKE_HARDWARE"):
+    from fake_hardware import H264Encoder, Output
+else:
+    from picamera2.encoders import H264Encoder
+    from picamera2.outputs import Output
+
+try:
+    import av  # PyAV, installed alongside picamera2 (python3-av)
+except ImportError:
+    av = None
+
+
+# === Project notes ============================================================
+# Live HLS without ffmpeg or files: the hardware H.264 encoder feeds this
+# Output, which cuts the stream into ~2 s MPEG-TS segments at keyframes (muxed
+# in memory with PyAV) and keeps only the newest few. flask_app.py and
+# asgi_app.py serve the playlist and segments straight from this ring, so
+# nothing touches the SD card.
+# ==============================================================================
+
+
+class HlsSegmenter(Output):
+    def __init__(self, resolution, fps=15, segment_seconds=2, segments=6):
+        super().__init__()
+        self.resolution = resolution
+        self.fps = fps
+        self.segment_seconds = segment_seconds
+        self.segments = deque(maxlen=segments)  # (number, duration, ts bytes)
+        self.lock = threading.Condition()
+        self.next_number = 0
+        self.frames = []  # (h264 bytes, keyframe, timestamp µs) of the open segment
+        self.first_timestamp = None
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        if timestamp is None:
+            return
+        if self.first_timestamp is None:
+            if not keyframe:
+                return  # segments must start on a keyframe
+            self.first_timestamp = timestamp
+        timestamp -= self.first_timestamp
+
+        # A big gap means the camera was paused, old segments are stale by now
+        if self.frames and timestamp - self.frames[-1][2] > self.segment_seconds * 2_000_000:
+            self.frames = []
+            with self.lock:
+                self.segments.clear()
+        if not self.frames and not keyframe:
+            return
+
+        if keyframe and self.frames:
+            duration = (timestamp - self.frames[0][2]) / 1_000_000
+            if duration >= self.segment_seconds:
+                self._close_segment(duration)
+        self.frames.append((bytes(frame), keyframe, timestamp))
+
+    def _close_segment(self, duration):
+        buf = io.BytesIO()
+        container = av.open(buf, mode="w", format="mpegts")
+        stream = container.add_stream("h264", rate=self.fps)
+        stream.width, stream.height = self.resolution
+        for data, keyframe, timestamp in self.frames:
+            packet = av.Packet(data)
+            packet.pts = packet.dts = timestamp
+            packet.time_base = Fraction(1, 1_000_000)
+            packet.is_keyframe = keyframe
+            packet.stream = stream
+            container.mux(packet)
+        container.close()
+        self.frames = []
+
+        with self.lock:
+            self.segments.append((self.next_number, duration, buf.getvalue()))
+            self.next_number += 1
+            self.lock.notify_all()
+
+    def playlist(self):
+        with self.lock:
+            segments = list(self.segments)
+        if not segments:
+            return None
+        target = math.ceil(max(duration for _, duration, _ in segments))
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{target}",
+            f"#EXT-X-MEDIA-SEQUENCE:{segments[0][0]}",
+        ]
+        for number, duration, _ in segments:
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(f"segment{number}.ts")
+        return "\n".join(lines) + "\n"
+
+    def segment(self, number):
+        with self.lock:
+            for n, _, data in self.segments:
+                if n == number:
+                    return data
+        return None
+
+    def wait_for_playlist(self, timeout):
+        """Block until the first segment exists (right after a camera restart)"""
+        with self.lock:
+            return self.lock.wait_for(lambda: len(self.segments) > 0, timeout)
+
+
+def start_hls(camera, bitrate=2_000_000, segment_seconds=2, segments=6):
+    """Attach an H.264 encoder + in-memory segmenter to a CameraStream"""
+    if av is None:
+        print("   PyAV not installed, HLS disabled")
+        return None
+    if camera.separate_process:
+        print("   HLS needs the camera in this process, disabled")
+        return None
+    fps = round(1.0 / camera.frame_interval)
+    segmenter = HlsSegmenter(camera.resolution, fps, segment_seconds, segments)
+    # repeat=True puts SPS/PPS before every keyframe so each segment decodes alone
+    encoder = H264Encoder(bitrate=bitrate, repeat=True, iperiod=fps * segment_seconds)
+    camera.add_encoder(encoder, segmenter)
+    return segmenter
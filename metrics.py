@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+import time
+import threading
+from bisect import bisect_left
+
+
+# === Project notes ============================================================
+# Tiny Prometheus-style metrics, no dependencies. Counters and histograms are a
+# couple of integer adds on the hot path; gauges are functions that only run
+# when /metrics is scraped. render() produces the Prometheus text format.
+# ==============================================================================
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SIZE_BUCKETS = (10_000, 25_000, 50_000, 100_000, 200_000, 400_000, 800_000)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    """with histogram.time(): ... observes the elapsed seconds"""
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Metric:
+    """A named metric family; with label names, .labels(...) picks the child"""
+
+    def __init__(self, kind, name, help_text, label_names=(), buckets=None):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = buckets
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.label_names:
+            self.default = self.labels()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = Histogram(self.buckets) if self.kind == "histogram" else Counter()
+                    self.children[values] = child
+        return child
+
+    def inc(self, amount=1):
+        self.default.inc(amount)
+
+    def observe(self, value):
+        self.default.observe(value)
+
+    def time(self):
+        return self.default.time()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self.children.items()):
+            labels = _format_labels(self.label_names, values)
+            if self.kind == "counter":
+                lines.append(f"{self.name}{labels} {child.value}")
+                continue
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), child.counts):
+                cumulative += count
+                bucket_labels = _format_labels((*self.label_names, "le"), (*values, bound))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class GaugeFunction:
+    """Gauge whose samples come from a function, evaluated only at scrape time"""
+
+    def __init__(self, name, help_text, label_names, function):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.function = function
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            samples = self.function()
+        except Exception as e:
+            print(f"Metrics error in {self.name}: {e}")
+            samples = []
+        for values, value in samples:
+            lines.append(f"{self.name}{_format_labels(self.label_names, values)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, metric):
+        # Modules may be imported more than once (e.g. the capture process)
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, label_names=()):
+        return self._add(Metric("counter", name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=TIME_BUCKETS):
+        return self._add(Metric("histogram", name, help_text, label_names, buckets))
+
+    def gauge_function(self, name, help_text, function, label_names=()):
+        """function() returns [(label values tuple, number), ...]"""
+        metric = GaugeFunction(name, help_text, label_names, function)
+        self.metrics[name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+gauge_function = REGISTRY.gauge_function
@@ -1,43 +1,109 @@
 #!/usr/bin/env python3
+import os
+import json
 import time
 import threading
-from gpiozero import MotionSensor
+from collections import deque
+if os.environ.get("BABY_MONITOR_FAKE_HARDWARE"):
+    from fake_hardware import MotionSensor
+else:
+    from gpiozero import MotionSensor
+from event_dispatcher import EventDispatcher
+import metrics
+
+MOTION_EVENTS = metrics.counter("motion_events_total", "Motion detections", ["source"])
 
 
 class MotionDetector:
     def __init__(self, gpio_pin=17):
-        self.pir = MotionSensor(gpio_pin)
+        self.gpio_pin = gpio_pin
+        self.pir = None  # created by start(), in the background
+        self.ready = threading.Event()
+        self.startup_error = None
         self.motion_detected = False
         self.last_motion_time = "Never"
-        self.callbacks = []
+
+        # Callbacks run on the dispatcher's workers, never on the GPIO thread
+        self.dispatcher = EventDispatcher("pir")
+
+        # Every edge gets a number so clients can ask for "anything after N"
+        self.event_count = 0
+        self.events = deque(maxlen=100)
+        self.condition = threading.Condition()
 
     def add_callback(self, callback):
         """Add a function to call when motion is detected"""
-        self.callbacks.append(callback)
+        self.dispatcher.subscribe(callback)
 
     def start(self):
-        """Start motion detection in background thread"""
+        """Open the PIR and hook its edges once it has warmed up, in the background"""
 
-        def detect_loop():
+        def attach():
+            try:
+                self.pir = MotionSensor(self.gpio_pin)
+            except Exception as e:
+                print(f"Motion sensor error: {e}")
+                self.startup_error = str(e)
+                return
             print("   Waiting 2 seconds for PIR warm-up...")
             time.sleep(2)
+            self.pir.when_motion = self._on_motion
+            self.pir.when_no_motion = self._on_no_motion
+            self.ready.set()
             print("   ✅ Motion sensor ready!")
 
-            while True:
-                if self.pir.motion_detected:
-                    self.motion_detected = True
-                    self.last_motion_time = time.strftime("%H:%M:%S")
-                    print(f"[{self.last_motion_time}] 🚨 MOTION!")
+        thread = threading.Thread(target=attach, daemon=True)
+        thread.start()
+        return thread
+
+    def _record(self, motion):
+        with self.condition:
+            self.motion_detected = motion
+            self.event_count += 1
+            event = {
+                'count': self.event_count,
+                'motion': motion,
+                'timestamp': time.time(),
+                'time': time.strftime("%H:%M:%S"),
+            }
+            if motion:
+                self.last_motion_time = event['time']
+            event['last_time'] = self.last_motion_time
+            self.events.append(event)
+            self.condition.notify_all()
+        return event
 
-                    # Call all registered callbacks
-                    for callback in self.callbacks:
-                        callback()
+    def _on_motion(self):
+        event = self._record(True)
+        print(f"[{event['time']}] 🚨 MOTION!")
 
-                    time.sleep(0.5)
-                    self.motion_detected = False
+        MOTION_EVENTS.labels("pir").inc()
+        self.dispatcher.dispatch()
 
-                time.sleep(0.02)
+    def _on_no_motion(self):
+        self._record(False)
 
-        thread = threading.Thread(target=detect_loop, daemon=True)
-        thread.start()
-        return thread
\ No newline at end of file
+    def events_since(self, count, timeout=None):
+        """Block until there are events newer than count, return them oldest first"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.event_count > count, timeout)
+            return [event for event in self.events if event['count'] > count]
+
+    def generate_events(self):
+        """Yield a Server-Sent Events stream that pushes every motion change"""
+        count = self.event_count
+        current = {
+            'count': count,
+            'motion': self.motion_detected,
+            'last_time': self.last_motion_time,
+        }
+        yield f"retry: 2000\ndata: {json.dumps(current)}\n\n"
+
+        while True:
+            events = self.events_since(count, timeout=15)
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                yield f"id: {event['count']}\ndata: {json.dumps(event)}\n\n"
+            count = events[-1]['count']
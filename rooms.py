@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+import io
+import math
+import time
+import threading
+from PIL import Image, ImageDraw
+from camera_stream import CameraStream, FrameSource, ENCODE_SECONDS, FRAME_BYTES
+from camera_process import ProcessCameraStream
+from motion_detector import MotionDetector
+from audio_stream import AudioStream
+from video_motion import VideoMotionDetector
+from clip_recorder import ClipRecorder
+from sound_detector import SoundDetector
+from stream_controller import StreamController
+from event_store import EventStore
+
+
+# === Project notes ============================================================
+# One Room per camera + microphone + PIR. Every room builds its own pipeline
+# (capture thread, encoders, audio ring, detectors, clip recorder, event log),
+# so rooms never wait on each other; the only shared piece is the encode CPU
+# budget, split between the rooms' StreamControllers by a CpuScheduler.
+# GridView puts every room's small ("low") stream side by side and encodes
+# that once, however many phones are watching the grid.
+#
+# The cameras are opened before any room is built: a camera in a separate
+# process is forked from here, and forking while other threads hold locks
+# (the audio capture, detectors, event dispatcher ...) can leave the child
+# stuck on one of them. So every capture process is forked first, while this
+# process has no other threads, and only then do the relay threads start.
+# ==============================================================================
+
+
+def open_cameras(rooms, camera_settings=None, camera_in_process=False, idle_timeout=None):
+    """Room id -> camera for each room's settings (their camera_num), before anything else starts"""
+    camera_class = ProcessCameraStream if camera_in_process else CameraStream
+    cameras = {room_id: camera_class(camera_num=settings.get('camera_num', 0), name=room_id,
+                                     idle_timeout=idle_timeout, **(camera_settings or {}))
+               for room_id, settings in rooms.items()}
+    for camera in cameras.values():
+        if camera.separate_process:
+            camera.start()
+    return cameras
+
+
+class Room:
+    def __init__(self, room_id, camera, title=None, audio_device=3, pir_pin=17, idle_timeout=None,
+                 clip_dir="/home/glen/clips", event_dir="/home/glen/events"):
+        self.id = room_id
+        self.title = title or room_id.title()
+
+        self.camera = camera  # from open_cameras()
+        self.audio = AudioStream(device_index=audio_device, idle_timeout=idle_timeout)
+        self.motion = MotionDetector(gpio_pin=pir_pin)
+        self.video_motion = VideoMotionDetector(self.camera)
+        self.recorder = ClipRecorder(self.camera, self.audio, out_dir=clip_dir)
+        self.sound = SoundDetector(self.audio)
+        self.controller = StreamController(self.camera)
+        self.event_store = EventStore(event_dir)
+
+    def components(self):
+        """The parts that start in the background, for /health"""
+        return {'camera': self.camera, 'audio': self.audio, 'motion': self.motion}
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'ready': all(c.ready.is_set() for c in self.components().values()),
+            'viewers': len(self.camera.clients),
+            'listeners': self.audio.listeners,
+            'motion': self.motion.motion_detected,
+            'last_motion': self.motion.last_motion_time,
+            'sound': self.sound.sound_detected,
+        }
+
+    def stop(self):
+        self.camera.stop()
+        self.audio.cleanup()
+        self.event_store.close()
+
+
+class GridView(FrameSource):
+    """Every room's camera in one picture, composed and encoded once per frame.
+
+    Only runs while somebody watches it; it then subscribes to each camera's
+    small tier (which the cameras encode once anyway for phones), decodes at
+    tile size with JPEG DCT scaling and only when a room has a new frame.
+    """
+
+    def __init__(self, rooms, tile_size=(640, 360), fps=5, name="grid"):
+        super().__init__(name, ("high",), fps)
+        self.rooms = rooms
+        self.tile_size = tile_size
+        self.quality = 60
+        self.columns = math.ceil(math.sqrt(len(rooms)))
+        rows = math.ceil(len(rooms) / self.columns)
+        self.size = (self.columns * tile_size[0], rows * tile_size[1])
+        self.ready = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self._compose_loop, daemon=True)
+        self.thread.start()
+
+    def _sources(self):
+        return [room.camera.tier("low") for room in self.rooms]
+
+    def _tile(self, jpeg):
+        image = Image.open(io.BytesIO(jpeg))
+        image.draft("RGB", self.tile_size)  # decode at 1/2, 1/4 or 1/8 size straight away
+        image = image.convert("RGB")
+        if image.size != self.tile_size:
+            image = image.resize(self.tile_size)
+        return image
+
+    def _compose_loop(self):
+        encode_seconds = ENCODE_SECONDS.labels(self.name, "high")
+        frame_bytes = FRAME_BYTES.labels(self.name, "high")
+        canvas = Image.new("RGB", self.size)
+        draw = ImageDraw.Draw(canvas)
+        tiles = {}  # room id -> sequence of the frame on the canvas
+        subscribed = False
+        self.ready.set()
+        while self.running:
+            time.sleep(self.frame_interval)
+
+            # Keep the room cameras' small tiers running only while the grid is watched
+            watched = self.broadcaster.subscribers > 0
+            if watched != subscribed:
+                subscribed = watched
+                for source in self._sources():
+                    if watched:
+                        source.subscribe()
+                    else:
+                        source.unsubscribe()
+                tiles.clear()
+            if not watched:
+                continue
+
+            started = time.perf_counter()
+            changed = False
+            captured = time.time()
+            for index, (room, source) in enumerate(zip(self.rooms, self._sources())):
+                sequence, jpeg, timestamp = source.latest()
+                if jpeg is None or tiles.get(room.id) == sequence:
+                    continue
+                x = index % self.columns * self.tile_size[0]
+                y = index // self.columns * self.tile_size[1]
+                try:
+                    canvas.paste(self._tile(jpeg), (x, y))
+                except OSError as e:
+                    print(f"Grid: bad frame from {room.id}: {e}")
+                    continue
+                draw.text((x + 8, y + 8), room.title, fill=(255, 255, 255))
+                tiles[room.id] = sequence
+                captured = min(captured, timestamp)
+                changed = True
+            if not changed:
+                continue
+
+            buf = io.BytesIO()
+            canvas.save(buf, format="JPEG", quality=self.quality)
+            jpeg = buf.getvalue()
+            encode_seconds.observe(time.perf_counter() - started)
+            frame_bytes.observe(len(jpeg))
+            self.broadcaster.publish(jpeg, captured)
+
+    def stop(self):
+        self.running = False
+        self.thread.join(timeout=2)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import time
+import threading
+from collections import deque
+import numpy as np
+from event_dispatcher import EventDispatcher
+
+
+class SoundDetector:
+    """Level meter and cry detector running on the shared microphone ring.
+
+    Every ~100 ms window gets RMS/peak levels (dBFS) and the share of its
+    energy inside the cry band (baby cries sit roughly in 300-3000 Hz). A loud
+    window that is mostly cry band counts as crying; enough of them in a row
+    raises a sound event through the callbacks.
+    """
+
+    def __init__(self, audio, window_ms=100, level_threshold_db=-35, cry_band=(300, 3000),
+                 cry_ratio=0.6, min_windows=5, hold_time=2.0):
+        self.audio = audio
+        self.window = int(audio.RATE * window_ms / 1000)
+        self.level_threshold_db = level_threshold_db
+        self.cry_ratio = cry_ratio
+        self.min_windows = min_windows
+        self.hold_time = hold_time
+
+        # Precomputed once, reused for every window
+        self.samples = np.zeros(self.window, dtype=np.float32)
+        self.filled = 0
+        self.taper = np.hanning(self.window).astype(np.float32)
+        freqs = np.fft.rfftfreq(self.window, 1.0 / audio.RATE)
+        self.band = (freqs >= cry_band[0]) & (freqs <= cry_band[1])
+
+        self.sound_detected = False
+        self.last_sound_time = "Never"
+        self.levels = {'rms_db': -120.0, 'peak_db': -120.0, 'cry_ratio': 0.0}
+        self.history = deque(maxlen=600)  # (timestamp, rms_db, peak_db, cry_ratio), 60 s
+        self.dispatcher = EventDispatcher("sound")
+        self.loud_windows = 0
+        self.last_loud = 0
+        self.running = False
+
+    def add_callback(self, callback):
+        """Add a function to call when crying/loud sound is detected"""
+        self.dispatcher.subscribe(callback)
+
+    def start(self):
+        """Start analysing audio in a background thread"""
+        self.running = True
+        thread = threading.Thread(target=self._detect_loop, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.running = False
+
+    def analyse(self, samples):
+        """Return (rms_db, peak_db, cry_ratio) for one window of float samples in -1..1"""
+        rms = float(np.sqrt(np.mean(samples * samples)))
+        peak = float(np.max(np.abs(samples)))
+        power = np.abs(np.fft.rfft(samples * self.taper)) ** 2
+        total = float(power.sum())
+        ratio = float(power[self.band].sum()) / total if total > 0 else 0.0
+        return (float(20 * np.log10(max(rms, 1e-6))), float(20 * np.log10(max(peak, 1e-6))), ratio)
+
+    def _feed(self, data):
+        """Split incoming PCM into analysis windows, return how many completed"""
+        pcm = np.frombuffer(data, dtype=np.int16)
+        done = 0
+        while len(pcm):
+            take = min(self.window - self.filled, len(pcm))
+            self.samples[self.filled:self.filled + take] = pcm[:take]
+            self.filled += take
+            pcm = pcm[take:]
+            if self.filled == self.window:
+                self.samples *= 1.0 / 32768
+                self._window_done()
+                self.filled = 0
+                done += 1
+        return done
+
+    def _window_done(self):
+        now = time.time()
+        rms_db, peak_db, ratio = self.analyse(self.samples)
+        self.levels = {'rms_db': round(rms_db, 1), 'peak_db': round(peak_db, 1),
+                       'cry_ratio': round(ratio, 2)}
+        self.history.append((now, self.levels['rms_db'], self.levels['peak_db'],
+                             self.levels['cry_ratio']))
+
+        if rms_db > self.level_threshold_db and ratio >= self.cry_ratio:
+            self.loud_windows += 1
+            self.last_loud = now
+        else:
+            self.loud_windows = 0
+
+        if self.loud_windows >= self.min_windows and not self.sound_detected:
+            self.sound_detected = True
+            self.last_sound_time = time.strftime("%H:%M:%S")
+            print(f"[{self.last_sound_time}] 🍼 CRYING? ({rms_db:.0f} dBFS)")
+            self.dispatcher.dispatch()
+        elif self.sound_detected and now - self.last_loud > self.hold_time:
+            self.sound_detected = False
+
+    def _detect_loop(self):
+        print("   ✅ Sound detection running!")
+        ring = self.audio.ring
+        ring.subscribe()
+        try:
+            cursor = ring.latest_cursor()
+            while self.running:
+                cursor, data = ring.read(cursor, timeout=1)
+                if data:
+                    self._feed(data)
+        finally:
+            ring.unsubscribe()
+
+    def level_history(self, seconds=60):
+        """Recent levels as compact columns, oldest first"""
+        since = time.time() - seconds
+        rows = [row for row in self.history if row[0] >= since]
+        return {
+            'time': [round(row[0], 1) for row in rows],
+            'rms_db': [row[1] for row in rows],
+            'peak_db': [row[2] for row in rows],
+            'cry_ratio': [row[3] for row in rows],
+        }
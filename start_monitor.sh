@@ -11,21 +11,22 @@ cd ~ || exit 1
 
 # 1. Kill any existing processes first
 echo "🧹 Cleaning up any existing processes..."
-./stop_monitor.sh  # Use the stop script to cleanup
-sleep 2
+./stop_monitor.sh  # Use the stop script to cleanup (waits for the old app to exit)
 
-# Extra camera cleanup
+# Extra camera cleanup, wait (up to 3 s) until the camera is really released
 echo "📷 Cleaning camera processes..."
 sudo pkill -f libcamera 2>/dev/null
 sudo pkill -f picamera 2>/dev/null
-sleep 3
+for i in $(seq 1 30); do
+    pgrep -f "libcamera|picamera" > /dev/null || break
+    sleep 0.1
+done
 
 # 2. Reset GPIO pins
 echo "🔄 Resetting GPIO pins..."
 if command -v gpio &> /dev/null; then
     gpio unexportall
 fi
-sleep 1
 
 # 3. Create log directory
 mkdir -p logs
@@ -48,14 +49,16 @@ FLASK_PID=$!
 # Save PID
 echo $FLASK_PID > /tmp/baby_monitor.pid
 
-# 5. Wait for website to be ready (with visual progress)
+# 5. Wait for the website, then for camera/mic/PIR (they start in the background)
+# /health answers 503 while components are starting and 200 once all are ready
 echo "⏳ Waiting for website to start..."
 echo -n "   Progress: ["
 
 TIMEOUT=40
 STARTED=0
+HEALTH=""
 
-for i in $(seq 1 $TIMEOUT); do
+for i in $(seq 1 $((TIMEOUT * 10))); do
     # Check if Flask process is still running
     if ! ps -p $FLASK_PID > /dev/null; then
         echo "] ✗"
@@ -64,19 +67,29 @@ for i in $(seq 1 $TIMEOUT); do
         exit 1
     fi
 
-    # Check if website responds
-    if curl -s --connect-timeout 2 "http://localhost:8080" > /dev/null 2>&1; then
+    CODE=$(curl -s -o /tmp/baby_monitor_health.json -w "%{http_code}" --max-time 1 \
+           "http://localhost:8080/health" 2>/dev/null)
+    if [ "$STARTED" -eq 0 ] && [ "$CODE" = "200" -o "$CODE" = "503" ]; then
         STARTED=1
-        echo -n "✓"
+        echo -n "✓ web"
+    fi
+    if [ "$CODE" = "200" ]; then
+        echo -n " ✓ camera/audio/motion"
+        break
+    fi
+    # Stop waiting once nothing is still starting (a component failed)
+    if [ "$STARTED" -eq 1 ] && ! grep -q '"starting"' /tmp/baby_monitor_health.json; then
+        echo -n " ✗ see health below"
         break
     fi
 
     # Show progress bar
-    if (( i % 4 == 0 )); then
+    if (( i % 10 == 0 )); then
         echo -n "."
     fi
-    sleep 1
+    sleep 0.1
 done
+HEALTH=$(cat /tmp/baby_monitor_health.json 2>/dev/null)
 
 echo "]"
 
@@ -88,6 +101,7 @@ if [ $STARTED -eq 1 ]; then
     echo "📡 Open your browser and go to:"
     echo "   http://${IP_ADDRESS}:8080"
     echo ""
+    echo "🩺 Health: ${HEALTH}"
     echo "📊 Check logs: tail -f ~/logs/monitor.log"
     echo "🛑 Stop with: ./stop_monitor.sh"
 else
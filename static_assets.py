@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+import gzip
+import hashlib
+
+try:
+    import brotli  # optional (python3-brotli), gzip is always there
+except ImportError:
+    brotli = None
+
+
+# === Project notes ============================================================
+# The page and alert sound are read and compressed once at startup and kept
+# in memory. Each is served with a strong ETag (one per encoding), so a reload
+# after a Wi-Fi blip is a 304, and with Cache-Control, so the alert sound isn't
+# asked for at all. Range requests (audio elements use them) are answered from
+# the same bytes. respond() only builds (status, headers, body); flask_app.py
+# and asgi_app.py each turn that into a response.
+# ==============================================================================
+
+ENCODINGS = ("br", "gzip")  # preferred first
+
+
+def accepted_encodings(header):
+    """Content codings an Accept-Encoding header allows (q=0 means refused)"""
+    accepted = set()
+    for part in (header or "").split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def parse_range(header, length):
+    """(start, end) inclusive for a single "bytes=" range, None to send everything,
+    ValueError when it can't be satisfied"""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None  # several ranges: allowed to answer with the whole body
+    first, _, last = header[6:].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), length - 1) if last else length - 1
+        else:
+            start, end = max(length - int(last), 0), length - 1
+    except ValueError:
+        return None
+    if last and first and int(last) < start:
+        return None  # "bytes=9-3" is malformed, not unsatisfiable: ignore it
+    if start > end or start >= length:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+class StaticAsset:
+    """One file held in memory, plain and precompressed, ready to serve"""
+
+    def __init__(self, body, content_type, cache_control="no-cache"):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        tag = hashlib.sha1(body).hexdigest()[:16]
+
+        # encoding -> (body, etag); compressed copies only when they save something
+        self.variants = {None: (body, f'"{tag}"')}
+        compressed = {"gzip": gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(body, quality=11)
+        for encoding, data in compressed.items():
+            if len(data) < 0.9 * len(body):
+                self.variants[encoding] = (data, f'"{tag}-{encoding}"')
+        self.etags = {etag for _, etag in self.variants.values()}
+
+    @classmethod
+    def from_file(cls, path, content_type, cache_control="no-cache"):
+        """Load a file, None (with a message) if it can't be read"""
+        try:
+            with open(path, "rb") as f:
+                return cls(f.read(), content_type, cache_control)
+        except OSError as e:
+            print(f"   Can't load {path}: {e}")
+            return None
+
+    def respond(self, accept_encoding=None, if_none_match=None, range_header=None,
+                if_range=None):
+        """(status, [(header, value)], body) for the request headers given"""
+        accepted = accepted_encodings(accept_encoding)
+        encoding = next((e for e in ENCODINGS if e in accepted and e in self.variants), None)
+        body, etag = self.variants[encoding]
+        headers = [("Content-Type", self.content_type), ("ETag", etag),
+                   ("Cache-Control", self.cache_control), ("Accept-Ranges", "bytes")]
+        if len(self.variants) > 1:
+            headers.append(("Vary", "Accept-Encoding"))
+        if encoding:
+            headers.append(("Content-Encoding", encoding))
+
+        # Any of our tags means the client has current bytes (304 names the one it'd get now);
+        # If-None-Match uses weak comparison, so W/"tag" matches "tag"
+        if if_none_match:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            if "*" in tags or tags & self.etags:
+                return 304, headers, b""
+
+        if range_header and (not if_range or if_range.strip() == etag):
+            try:
+                byte_range = parse_range(range_header, len(body))
+            except ValueError:
+                headers.append(("Content-Range", f"bytes */{len(body)}"))
+                return 416, headers + [("Content-Length", "0")], b""
+            if byte_range is not None:
+                start, end = byte_range
+                headers.append(("Content-Range", f"bytes {start}-{end}/{len(body)}"))
+                body = body[start:end + 1]
+                return 206, headers + [("Content-Length", str(len(body)))], body
+        return 200, headers + [("Content-Length", str(len(body)))], body
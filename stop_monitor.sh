@@ -15,7 +15,10 @@ if [ -f /tmp/baby_monitor.pid ]; then
     if ps -p $PID > /dev/null; then
         echo "Stopping process $PID gently..."
         kill $PID
-        sleep 2
+        for i in $(seq 1 50); do
+            ps -p $PID > /dev/null || break
+            sleep 0.1
+        done
     fi
     rm -f /tmp/baby_monitor.pid
 fi
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+import time
+import threading
+from camera_stream import ENCODE_SECONDS, FRAME_BYTES
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def limit_range(name, value, lowest, highest):
+    """(min, max) from a number or a [min, max] pair within [lowest, highest], else ValueError"""
+    if is_number(value):
+        value = (value, value)
+    if (not isinstance(value, (list, tuple)) or len(value) != 2
+            or not all(is_number(v) for v in value)):
+        raise ValueError(f"{name} must be a number or [min, max]")
+    low, high = value
+    if low > high:
+        raise ValueError(f"{name}: minimum above maximum")
+    if low < lowest or high > highest:
+        raise ValueError(f"{name} must be between {lowest} and {highest}")
+    return low, high
+
+
+class StreamController:
+    """Adapts JPEG quality, frame rate and the "auto" tier to load and activity.
+
+    Once a second it reads the encode time and output bytes from the metrics
+    histograms and how many frames each viewer skipped, steps quality (then
+    tier, then frame rate) down when the Pi or the network can't keep up and
+    back up when they can. With no motion or sound for still_after seconds the
+    frame rate drops to still_fps; the next detection restores it at once.
+    pin() narrows any limit, e.g. pin(fps=15) or pin(quality=(60, 80), tier="high").
+
+    Quality only applies to tiers encoded in Python; the hardware MJPEG
+    encoder's quality is fixed when it starts. With several cameras a
+    CpuScheduler sets `share`, the CPU (in cores) this camera's encoding may use.
+    """
+
+    def __init__(self, camera, interval=1.0, quality=(40, 70), fps=None, still_after=30,
+                 still_fps=2, max_kbps=None):
+        self.camera = camera
+        self.interval = interval
+        self.still_after = still_after
+        self.still_fps = still_fps
+        self.defaults = {
+            'quality': quality,
+            'fps': fps or (still_fps, 1.0 / camera.frame_interval),
+            'tier': None,  # None = chosen by the controller
+            'max_kbps': max_kbps,
+        }
+        self.limits = dict(self.defaults)
+        self.lock = threading.Lock()
+
+        self.quality = camera.quality
+        self.fps = 1.0 / camera.frame_interval
+        self.max_fps = self.fps  # the camera's configured rate
+        self.fps_cap = self.fps  # lowered while encoding can't keep up
+        self.last_activity = time.time()
+        self.detectors = []  # see watch()
+
+        # Cores this camera may spend encoding, None = no limit (see CpuScheduler)
+        self.share = None
+
+        # Last readings, for status()
+        self.load = 0.0
+        self.cpu = 0.0  # encode seconds per second
+        self.kbps = 0.0
+        self.congested = False
+        self.running = False
+
+    def watch(self, detector):
+        """Count a detector's callbacks (motion, crying) and its ongoing detection as activity"""
+        self.detectors.append(detector)
+        detector.add_callback(self.on_activity)
+
+    def is_still(self):
+        # Callbacks only fire when motion/sound starts, so a detection that is
+        # still going on counts as activity too
+        if any(getattr(d, 'motion_detected', False) or getattr(d, 'sound_detected', False)
+               for d in self.detectors):
+            self.last_activity = time.time()
+            return False
+        return time.time() - self.last_activity > self.still_after
+
+    def on_activity(self):
+        self.last_activity = time.time()
+        if self.running and self.fps < self.limits['fps'][1]:
+            self._apply()  # full frame rate right away, not on the next step
+
+    def pin(self, quality=None, fps=None, tier=None, max_kbps=None):
+        """Restrict quality/fps to a value or (min, max), force a tier, cap the bit rate.
+
+        Everything is checked before anything changes; ValueError leaves the limits as they were.
+        """
+        self._check_controllable()
+        changes = {}
+        if quality is not None:
+            changes['quality'] = limit_range('quality', quality, 1, 100)
+        if fps is not None:
+            changes['fps'] = limit_range('fps', fps, 0.5, self.max_fps)
+        if tier is not None:
+            if not isinstance(tier, str) or tier not in self.camera.tiers:
+                raise ValueError(f"unknown tier {tier!r}")
+            changes['tier'] = tier
+        if max_kbps is not None:
+            if not is_number(max_kbps) or max_kbps <= 0:
+                raise ValueError("max_kbps must be a positive number")
+            changes['max_kbps'] = max_kbps
+        with self.lock:
+            self.limits.update(changes)
+        self._apply()
+
+    def _check_controllable(self):
+        if self.camera.separate_process:
+            raise ValueError("quality and frame rate can't be changed while the camera "
+                             "runs in a separate process")
+
+    def reset(self):
+        """Back to the default limits"""
+        self._check_controllable()
+        with self.lock:
+            self.limits = dict(self.defaults)
+        self._apply()
+
+    def status(self):
+        return {
+            'quality': self.quality,
+            'fps': round(self.fps, 1),
+            'auto_tier': self.camera.auto_tier,
+            'still': self.is_still(),
+            'encode_load': round(self.load, 3),
+            'encode_cpu': round(self.cpu, 3),
+            'cpu_share': None if self.share is None else round(self.share, 3),
+            'kbps': round(self.kbps),
+            'congested': self.congested,
+            'limits': self.limits,
+        }
+
+    def start(self):
+        if self.camera.separate_process:
+            print("   Stream controller needs the camera in this process, skipped")
+            return None
+        self.running = True
+        thread = threading.Thread(target=self._control_loop, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.running = False
+
+    def _histogram_totals(self, histogram):
+        tiers = list(self.camera.tiers)
+        name = self.camera.name
+        return ([histogram.labels(name, tier).sum for tier in tiers],
+                [histogram.labels(name, tier).count for tier in tiers])
+
+    def _control_loop(self):
+        encode_sums, encode_counts = self._histogram_totals(ENCODE_SECONDS)
+        byte_sums, _ = self._histogram_totals(FRAME_BYTES)
+        client_totals = {}
+        last = time.time()
+        while self.running:
+            time.sleep(self.interval)
+            now = time.time()
+            elapsed, last = now - last, now
+
+            # Encode time per captured frame (every watched tier is encoded once
+            # per frame) as a fraction of the frame interval
+            sums, counts = self._histogram_totals(ENCODE_SECONDS)
+            frames = max((c - p for c, p in zip(counts, encode_counts)), default=0)
+            seconds = sum(s - p for s, p in zip(sums, encode_sums))
+            encode_sums, encode_counts = sums, counts
+            self.load = seconds / frames / self.camera.frame_interval if frames else 0.0
+            self.cpu = seconds / elapsed
+
+            sums, _ = self._histogram_totals(FRAME_BYTES)
+            self.kbps = sum(s - p for s, p in zip(sums, byte_sums)) * 8 / elapsed / 1000
+            byte_sums = sums
+
+            # Congested when most viewers skipped over a quarter of their frames
+            slow = 0
+            clients = list(self.camera.clients)
+            totals = {}
+            for client in clients:
+                sent, dropped = client.frames_sent, client.frames_dropped
+                before_sent, before_dropped = client_totals.get(client, (sent, dropped))
+                totals[client] = (sent, dropped)
+                delta_sent, delta_dropped = sent - before_sent, dropped - before_dropped
+                if delta_dropped > 0.25 * (delta_sent + delta_dropped):
+                    slow += 1
+            client_totals = totals
+            self.congested = bool(clients) and slow * 2 > len(clients)
+
+            if self.camera.active:
+                self._adjust()
+            self._apply()
+
+    def _adjust(self):
+        """One step towards what the last interval's readings allow"""
+        with self.lock:
+            limits = dict(self.limits)
+        q_min, q_max = limits['quality']
+        max_kbps = limits['max_kbps']
+        over_budget = max_kbps is not None and self.kbps > max_kbps
+        share = self.share
+        over_share = share is not None and self.cpu > share
+
+        if self.load > 0.6 or self.congested or over_budget or over_share:
+            if self.quality > q_min:
+                self.quality = max(self.quality - 10, q_min)
+            elif self.congested and self.camera.auto_tier != "low" and "low" in self.camera.tiers:
+                self.camera.auto_tier = "low"
+            elif self.load > 0.9 or self.congested or over_share:
+                self.fps_cap = max(self.fps_cap * 0.75, limits['fps'][0])
+        elif (self.load < 0.3 and (max_kbps is None or self.kbps < 0.8 * max_kbps)
+              and (share is None or self.cpu < 0.8 * share)):
+            if self.fps_cap < limits['fps'][1]:
+                self.fps_cap = min(self.fps_cap + 1, limits['fps'][1])
+            elif self.camera.auto_tier != "high":
+                self.camera.auto_tier = "high"
+            elif self.quality < q_max:
+                self.quality = min(self.quality + 5, q_max)
+
+    def _apply(self):
+        """Push the current settings to the camera, clamped to the limits"""
+        with self.lock:
+            limits = dict(self.limits)
+        q_min, q_max = limits['quality']
+        f_min, f_max = limits['fps']
+        self.quality = int(min(max(self.quality, q_min), q_max))
+        self.camera.quality = self.quality
+        if limits['tier'] is not None:
+            self.camera.auto_tier = limits['tier']
+
+        fps = min(self.fps_cap, self.still_fps if self.is_still() else f_max)
+        fps = min(max(fps, f_min), f_max)
+        if abs(fps - self.fps) > 0.01:
+            self.fps = fps
+            self.camera.set_frame_rate(fps)
+
+
+def fair_shares(demands, budget):
+    """Max-min fair split of budget: small demands are met, the rest is divided
+    evenly among those asking for more; budget nobody asked for is spread evenly"""
+    shares = {}
+    remaining = budget
+    pending = sorted(demands.items(), key=lambda item: item[1])
+    while pending:
+        equal = remaining / len(pending)
+        name, demand = pending[0]
+        if demand > equal:
+            for name, _ in pending:
+                shares[name] = equal
+            return shares
+        shares[name] = demand
+        remaining -= demand
+        pending.pop(0)
+    return {name: share + remaining / len(shares) for name, share in shares.items()}
+
+
+class CpuScheduler:
+    """Shares one encode CPU budget fairly between several cameras' controllers.
+
+    Every interval each camera asks for what it used plus headroom to grow;
+    cameras asking for less than an equal split get that and the rest goes to
+    the busy ones. Each controller then steps its own quality,
+    tier and frame rate to stay inside its share, so a room full of viewers
+    can't starve the others.
+    """
+
+    def __init__(self, controllers, budget=2.0, interval=1.0, headroom=1.5, min_share=0.05):
+        self.controllers = controllers  # name -> StreamController
+        self.budget = budget            # cores for JPEG encoding across all cameras
+        self.interval = interval
+        self.headroom = headroom
+        self.min_share = min_share
+        self.running = False
+
+    def status(self):
+        return {
+            'budget': self.budget,
+            'cameras': {name: {'cpu': round(c.cpu, 3),
+                               'share': None if c.share is None else round(c.share, 3)}
+                        for name, c in self.controllers.items()},
+        }
+
+    def start(self):
+        self.running = True
+        thread = threading.Thread(target=self._schedule_loop, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.running = False
+
+    def _schedule_loop(self):
+        while self.running:
+            time.sleep(self.interval)
+            demands = {name: max(c.cpu * self.headroom, self.min_share)
+                       for name, c in self.controllers.items()}
+            for name, share in fair_shares(demands, self.budget).items():
+                self.controllers[name].share = share
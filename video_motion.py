@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+import time
+import threading
+from collections import deque
+import numpy as np
+from motion_detector import MOTION_EVENTS
+from event_dispatcher import EventDispatcher
+
+
+class VideoMotionDetector:
+    """Camera based motion detection on the small greyscale frames CameraStream provides.
+
+    Keeps a running-average background, counts pixels that differ from it by
+    more than `threshold` inside the region of interest, and reports motion
+    while that fraction is above `min_changed`. Works on ~160x90 frames so it
+    keeps up with the camera frame rate for very little CPU.
+    """
+
+    def __init__(self, camera, threshold=25, min_changed=0.01, learning_rate=0.05,
+                 roi=None, hold_time=1.0):
+        self.camera = camera
+        self.threshold = threshold
+        self.min_changed = min_changed
+        self.learning_rate = learning_rate
+        self.roi = roi  # (left, top, right, bottom) as fractions of the frame, None = everything
+        self.hold_time = hold_time
+
+        self.motion_detected = False
+        self.last_motion_time = "Never"
+        self.score = 0.0
+        self.scores = deque(maxlen=300)  # (timestamp, score), ~20 s at 15 fps
+        self.dispatcher = EventDispatcher("camera")
+
+        self.background = None
+        self.mask = None
+        self.running = False
+
+    def add_callback(self, callback):
+        """Add a function to call when motion is detected"""
+        self.dispatcher.subscribe(callback)
+
+    def start(self):
+        """Start analysing frames in a background thread"""
+        if self.camera.separate_process:
+            print("   Video motion detection needs the camera in this process, skipped")
+            return None
+        self.running = True
+        thread = threading.Thread(target=self._detect_loop, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.running = False
+
+    def _build_buffers(self, shape):
+        height, width = shape
+        self.background = np.empty(shape, dtype=np.float32)
+        self.frame = np.empty(shape, dtype=np.float32)
+        self.diff = np.empty(shape, dtype=np.float32)
+        self.mask = np.zeros(shape, dtype=bool)
+        if self.roi is None:
+            self.mask[:] = True
+        else:
+            left, top, right, bottom = self.roi
+            self.mask[int(top * height):int(bottom * height),
+                      int(left * width):int(right * width)] = True
+        self.mask_pixels = max(int(self.mask.sum()), 1)
+
+    def process(self, luma):
+        """Update the background with one frame and return its motion score (0..1)"""
+        if self.background is None or self.background.shape != luma.shape:
+            self._build_buffers(luma.shape)
+            self.background[:] = luma
+            return 0.0
+
+        # All in preallocated float32 buffers, no per-frame allocation
+        np.copyto(self.frame, luma)
+        np.subtract(self.frame, self.background, out=self.diff)
+        np.abs(self.diff, out=self.diff)
+        changed = np.count_nonzero((self.diff > self.threshold) & self.mask)
+
+        # background = (1 - rate) * background + rate * frame
+        self.background *= 1.0 - self.learning_rate
+        self.frame *= self.learning_rate
+        self.background += self.frame
+        return changed / self.mask_pixels
+
+    def _detect_loop(self):
+        print("   ✅ Video motion detection running!")
+        self.camera.luma.subscribe()
+        sequence = 0
+        last_motion = 0
+        try:
+            while self.running:
+                new_sequence, luma = self.camera.luma.wait_for_frame(sequence, timeout=1)
+                if new_sequence == sequence:
+                    continue
+                sequence = new_sequence
+
+                now = time.time()
+                self.score = self.process(luma)
+                self.scores.append((now, self.score))
+
+                if self.score >= self.min_changed:
+                    last_motion = now
+                    if not self.motion_detected:
+                        self.motion_detected = True
+                        self.last_motion_time = time.strftime("%H:%M:%S")
+                        print(f"[{self.last_motion_time}] 🎥 MOTION! (score {self.score:.3f})")
+                        MOTION_EVENTS.labels("camera").inc()
+                        self.dispatcher.dispatch()
+                elif self.motion_detected and now - last_motion > self.hold_time:
+                    self.motion_detected = False
+        finally:
+            self.camera.luma.unsubscribe()